@@ -0,0 +1,174 @@
+"""エンコード設定のプロファイルごとのコスト計測
+
+サンプル画像 (と全サンプルを並べたスライドショー) を各プロファイルでエンコードし、
+CPU 時間・ビットレート・最初のセグメントまでの時間・1コアあたりのストリーム数を出す
+
+    python bench/encoding.py
+    python bench/encoding.py --profiles default,light --images a.jpg b.png --seconds 120
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import standins  # noqa: E402
+from util import ImageStream, encoding  # noqa: E402
+
+
+def children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def segment_bytes(outdir: Path) -> int:
+    return sum(path.stat().st_size for path in outdir.glob("seg_*.ts"))
+
+
+def measure_cost(cmd: list[str], outdir: Path, seconds: int) -> dict:
+    """-re なしで seconds 秒分をエンコードして CPU 時間と出力サイズを測る"""
+    cpu = children_cpu()
+    start = time.perf_counter()
+    subprocess.run(
+        cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+    )
+    wall = time.perf_counter() - start
+    cpu = children_cpu() - cpu
+    size = segment_bytes(outdir)
+    return {
+        "cpu_seconds": cpu,
+        "wall_seconds": wall,
+        "cpu_seconds_per_stream_hour": cpu / seconds * 3600,
+        # 実時間で流すとき、1ストリームが使うコアは cpu / seconds
+        "streams_per_core": seconds / cpu if cpu > 0 else float("inf"),
+        "bitrate_kbps": size * 8 / seconds / 1000,
+    }
+
+
+def measure_first_segment(cmd: list[str], outdir: Path, timeout: float = 60) -> float:
+    """サーバと同じく -re で起動し、プレイリストができるまでの秒数を測る"""
+    playlist = outdir / "index.m3u8"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while not playlist.exists() or playlist.stat().st_size <= 0:
+            if time.perf_counter() - start > timeout or process.poll() is not None:
+                return float("nan")
+            time.sleep(0.02)
+        return time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def corpus(workdir: Path, images: list[str]) -> dict[str, str]:
+    """name -> 画像パス
+
+    画像を指定しなければ、単色 (エンコードが軽い) と乱数画素 (重い) を生成する
+    """
+    if images:
+        return {Path(image).name: str(Path(image).resolve()) for image in images}
+    generated = {}
+    for name, flat in [("flat", True), ("noise", False)]:
+        path = workdir / f"{name}.png"
+        path.write_bytes(standins.make_png(1024, seed=0, flat=flat))
+        generated[name] = str(path)
+    return generated
+
+
+def bench(
+    profile: dict, name: str, kind: str, paths: list[str], args, workdir: Path
+) -> dict:
+    """kind (image, slideshow) のコストと最初のセグメントまでの時間を測る"""
+    result = {}
+    for phase in ("cost", "first_segment"):
+        outdir = workdir / f"{profile['name']}-{name}-{kind}-{phase}"
+        outdir.mkdir()
+        realtime = phase == "first_segment"
+        if kind == "image":
+            cmd = encoding.image_command(
+                profile,
+                paths[0],
+                outdir,
+                args.seconds,
+                hls_list_size=0,
+                realtime=realtime,
+            )
+        else:
+            loop_count = args.seconds // (args.interval * len(paths)) + 1
+            concat_file = ImageStream.write_concat(
+                outdir, paths, args.interval, loop_count
+            )
+            cmd = encoding.slideshow_command(
+                profile,
+                concat_file,
+                outdir,
+                args.seconds,
+                hls_list_size=0,
+                realtime=realtime,
+            )
+        if phase == "cost":
+            result = measure_cost(cmd, outdir, args.seconds)
+        else:
+            result["first_segment_seconds"] = measure_first_segment(cmd, outdir)
+    return result
+
+
+def print_result(profile_name: str, name: str, kind: str, stats: dict):
+    print(
+        f"{profile_name:<10} {name:<12} {kind:<10} "
+        f"cpu/h={stats['cpu_seconds_per_stream_hour']:7.1f}s "
+        f"streams/core={stats['streams_per_core']:6.1f} "
+        f"bitrate={stats['bitrate_kbps']:7.1f}kbps "
+        f"first_segment={stats['first_segment_seconds']:5.2f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--profiles",
+        default=",".join(encoding.load_profiles(os.getenv("ENCODING_PROFILES"))),
+        help="comma separated profile names",
+    )
+    parser.add_argument("--images", nargs="*", default=[], help="sample images")
+    parser.add_argument("--seconds", type=int, default=60, help="output length")
+    parser.add_argument("--interval", type=int, default=8, help="slideshow interval")
+    parser.add_argument("--output", help="write the result as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="video-encoding-") as temp_dir:
+        workdir = Path(temp_dir)
+        samples = corpus(workdir, args.images)
+        # スライドショーは全サンプルを交互に並べる (単色と乱数画素の切り替えなど)
+        slides = list(samples.values())
+        if len(slides) < 2:
+            slides *= 2
+        for profile_name in args.profiles.split(","):
+            profile = encoding.get_profile(profile_name)
+            results[profile_name] = {"profile": profile, "samples": {}}
+            for name, path in samples.items():
+                stats = bench(profile, name, "image", [path], args, workdir)
+                results[profile_name]["samples"][name] = stats
+                print_result(profile_name, name, "image", stats)
+            stats = bench(profile, "all", "slideshow", slides, args, workdir)
+            results[profile_name]["slideshow"] = stats
+            print_result(profile_name, "all", "slideshow", stats)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""負荷試験
+
+代役サービス (bench/standins.py) を立て、video-server をサブプロセスで起動し、
+トラフィックの組み合わせを流して time-to-redirect 等を測る
+
+    python bench/loadtest.py --mix video=50,image_hot=20,image_cold=10 --requests 500
+    python bench/loadtest.py --output before.json
+    python bench/loadtest.py --output after.json --compare before.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import uvicorn
+
+sys.path.insert(0, str(Path(__file__).parent))
+import standins  # noqa: E402
+
+REPO = Path(__file__).resolve().parent.parent
+DEFAULT_MIX = "video=40,image_hot=20,image_cold=10,slideshow=5,search=10,random=5"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_standins(port: int, latency: float, image_kb: int):
+    app = standins.create_app(latency=latency, image_kb=image_kb)
+    config = uvicorn.Config(app, port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    return server
+
+
+def start_server(
+    port: int, standins_base: str, workdir: Path, rate_limits: bool
+) -> subprocess.Popen:
+    """video-server を起動する (ffmpeg もまとめて止められるよう新しいセッションで)
+
+    rate_limits=False ならレート制限を実質無効にする (全リクエストが同じ IP なので)
+    """
+    (workdir / "stream").mkdir(exist_ok=True)
+    env = {
+        **os.environ,
+        "YOUTUBE_API_KEY": "bench",
+        "YOUTUBE_API_BASE": f"{standins_base}/youtube/v3",
+        "RANDOM_VIDEOS_URL": f"{standins_base}/gist",
+    }
+    if not rate_limits:
+        unlimited = {"client": [1e6, 1e6], "global": [1e6, 1e6]}
+        limits_file = workdir / "rate_limits.json"
+        limits_file.write_text(
+            json.dumps({op: unlimited for op in ("stream", "search", "grid")})
+        )
+        env["RATE_LIMITS"] = str(limits_file)
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "--app-dir",
+            str(REPO),
+            "video-server:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=workdir,
+        env=env,
+        start_new_session=True,
+    )
+
+
+async def wait_ready(base: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.time() < deadline:
+            try:
+                await client.get(f"{base}/metrics")
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError("video-server did not start")
+
+
+class Traffic:
+    """シナリオごとのリクエスト (クエリ) を作る"""
+
+    HOT_IMAGES = 3
+
+    def __init__(self, standins_base: str):
+        self.base = standins_base
+
+    @staticmethod
+    def name() -> str:
+        """未キャッシュの名前 (--seed で再現できるよう random から作る)"""
+        return f"{random.getrandbits(64):016x}"
+
+    def video(self):
+        return {"url": f"{self.base}/video/{self.name()}.mp4"}
+
+    def image_hot(self):
+        return {"url": f"{self.base}/img/hot-{random.randrange(self.HOT_IMAGES)}.jpg"}
+
+    def image_cold(self):
+        # 拡張子なしで HEAD による判定も通す
+        return {"url": f"{self.base}/img/cold-{self.name()}"}
+
+    def slideshow(self):
+        key = self.name()
+        return {
+            "url": [f"{self.base}/img/slide-{key}-{i}.jpg" for i in range(3)],
+            "interval": 4,
+            "loop": 2,
+        }
+
+    def search(self):
+        return {"url": f"y!kw{random.randrange(20)}"}
+
+    def random(self):
+        return {"url": "random"}
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        weights[name.strip()] = int(weight)
+    return weights
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    idx = min(int(round(p / 100 * (len(values) - 1))), len(values) - 1)
+    return values[idx]
+
+
+def summarize(latencies: list[float]) -> dict:
+    return {
+        "count": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else float("nan"),
+    }
+
+
+def rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class Monitor:
+    """ffmpeg プロセス数とメモリ使用量のピークを記録する"""
+
+    METRIC = re.compile(r"^(video_ffmpeg_processes|video_ffmpeg_rss_bytes)\S* (\S+)$")
+
+    def __init__(self, base: str, server_pid: int):
+        self.base = base
+        self.server_pid = server_pid
+        self.peak_ffmpeg = 0
+        self.peak_server_rss = 0
+        self.peak_ffmpeg_rss = 0
+
+    async def run(self, interval: float = 0.5):
+        async with httpx.AsyncClient() as client:
+            while True:
+                self.peak_server_rss = max(
+                    self.peak_server_rss, rss_bytes(self.server_pid)
+                )
+                try:
+                    response = await client.get(f"{self.base}/metrics")
+                    ffmpeg_rss = 0
+                    for line in response.text.splitlines():
+                        match = self.METRIC.match(line)
+                        if match is None:
+                            continue
+                        if match.group(1) == "video_ffmpeg_processes":
+                            self.peak_ffmpeg = max(
+                                self.peak_ffmpeg, int(float(match.group(2)))
+                            )
+                        else:
+                            ffmpeg_rss += float(match.group(2))
+                    self.peak_ffmpeg_rss = max(self.peak_ffmpeg_rss, int(ffmpeg_rss))
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(interval)
+
+
+async def replay(
+    base: str, traffic: Traffic, mix: dict[str, int], requests: int, concurrency: int
+) -> dict[str, list]:
+    """mix の重みでシナリオを選んでリクエストを流す"""
+    names = list(mix)
+    plan = random.choices(names, weights=[mix[n] for n in names], k=requests)
+    results = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(timeout=120.0) as client:
+
+        async def one(name: str):
+            params = getattr(traffic, name)()
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(f"{base}/video", params=params)
+                    elapsed = time.perf_counter() - start
+                    if response.status_code in (302, 307):
+                        results[name].append(elapsed)
+                    else:
+                        errors[name] += 1
+                except httpx.HTTPError:
+                    errors[name] += 1
+
+        await asyncio.gather(*(one(name) for name in plan))
+    return {"latencies": results, "errors": errors}
+
+
+async def burst(base: str, traffic: Traffic, size: int) -> dict:
+    """同じ未キャッシュ画像への同時リクエスト"""
+    params = traffic.image_cold()
+    latencies = []
+    errors = 0
+    async with httpx.AsyncClient(timeout=120.0) as client:
+
+        async def one():
+            nonlocal errors
+            start = time.perf_counter()
+            try:
+                response = await client.get(f"{base}/video", params=params)
+                if response.status_code in (302, 307):
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+
+        await asyncio.gather(*(one() for _ in range(size)))
+    return {**summarize(latencies), "errors": errors}
+
+
+async def run(args) -> dict:
+    standins_port = free_port()
+    server_port = free_port()
+    standins_base = f"http://127.0.0.1:{standins_port}"
+    base = f"http://127.0.0.1:{server_port}"
+
+    start_standins(standins_port, args.latency, args.image_kb)
+    workdir = Path(tempfile.mkdtemp(prefix="video-bench-"))
+    server = start_server(server_port, standins_base, workdir, args.rate_limits)
+    try:
+        await wait_ready(base)
+        traffic = Traffic(standins_base)
+        monitor = Monitor(base, server.pid)
+        monitor_task = asyncio.create_task(monitor.run())
+
+        started = time.perf_counter()
+        replayed = await replay(
+            base, traffic, parse_mix(args.mix), args.requests, args.concurrency
+        )
+        elapsed = time.perf_counter() - started
+        burst_result = await burst(base, traffic, args.burst) if args.burst else None
+        monitor_task.cancel()
+
+        all_latencies = [t for ts in replayed["latencies"].values() for t in ts]
+        return {
+            "config": vars(args),
+            "overall": {
+                **summarize(all_latencies),
+                "errors": sum(replayed["errors"].values()),
+                "throughput_rps": len(all_latencies) / elapsed,
+            },
+            "scenarios": {
+                name: {**summarize(ts), "errors": replayed["errors"][name]}
+                for name, ts in replayed["latencies"].items()
+            },
+            "burst": burst_result,
+            "peak_ffmpeg_processes": monitor.peak_ffmpeg,
+            "peak_ffmpeg_rss_bytes": monitor.peak_ffmpeg_rss,
+            "peak_server_rss_bytes": monitor.peak_server_rss,
+        }
+    finally:
+        # video-server と ffmpeg をまとめて止める
+        try:
+            os.killpg(server.pid, signal.SIGTERM)
+            server.wait(timeout=10)
+        except (ProcessLookupError, subprocess.TimeoutExpired):
+            os.killpg(server.pid, signal.SIGKILL)
+
+
+def report(result: dict, baseline: dict | None = None):
+    def row(name: str, stats: dict, before: dict | None):
+        line = (
+            f"{name:<12} n={stats['count']:<5} err={stats['errors']:<4} "
+            f"p50={stats['p50_ms']:8.1f}ms p95={stats['p95_ms']:8.1f}ms "
+            f"p99={stats['p99_ms']:8.1f}ms"
+        )
+        if before is not None and before.get("count"):
+            line += f"  (p95 before {before['p95_ms']:.1f}ms)"
+        print(line)
+
+    base_scenarios = (baseline or {}).get("scenarios", {})
+    for name, stats in result["scenarios"].items():
+        row(name, stats, base_scenarios.get(name))
+    row("overall", result["overall"], (baseline or {}).get("overall"))
+    if result["burst"]:
+        row("burst", result["burst"], (baseline or {}).get("burst"))
+    print(f"throughput: {result['overall']['throughput_rps']:.1f} req/s")
+    print(f"peak ffmpeg processes: {result['peak_ffmpeg_processes']}")
+    print(f"peak ffmpeg RSS: {result['peak_ffmpeg_rss_bytes'] / 2**20:.1f} MiB")
+    print(f"peak server RSS: {result['peak_server_rss_bytes'] / 2**20:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario=weight,...")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--burst", type=int, default=20, help="0 to disable")
+    parser.add_argument("--latency", type=float, default=0.05, help="stand-in latency")
+    parser.add_argument("--image-kb", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--rate-limits", action="store_true", help="keep the default rate limits"
+    )
+    parser.add_argument("--output", help="write the result as JSON")
+    parser.add_argument("--compare", help="baseline JSON from a previous --output")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    result = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(result, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
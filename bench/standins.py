@@ -0,0 +1,115 @@
+"""ベンチマーク用の外部サービスの代役
+
+- 画像CDN: /img/{name}  (HEAD/GET, 乱数画素の PNG)
+- 動画: /video/{name}.mp4  (HEAD のみ, content-type: video/mp4)
+- YouTube Data API: /youtube/v3/search
+- サムネイル: /thumb/{name}.jpg
+- ランダム動画リスト (gist): /gist
+
+レイテンシと画像サイズは create_app の引数、またはクエリ (?latency=, ?kb=) で変えられる
+"""
+
+import asyncio
+import hashlib
+import random
+import struct
+import zlib
+from functools import lru_cache
+
+from fastapi import FastAPI, Request, Response
+
+
+def make_png(kb: int, seed: int, flat: bool = False) -> bytes:
+    """およそ kb キロバイト分の画素の PNG
+
+    既定では圧縮が効かないよう乱数画素、flat=True なら単色
+    """
+    side = max(int((kb * 1024 / 3) ** 0.5), 16)
+    rng = random.Random(seed)
+    if flat:
+        row = b"\x00" + bytes(rng.randbytes(3)) * side
+        raw = row * side
+    else:
+        raw = b"".join(b"\x00" + rng.randbytes(side * 3) for _ in range(side))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        crc = zlib.crc32(tag + data) & 0xFFFFFFFF
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", crc)
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 1))
+        + chunk(b"IEND", b"")
+    )
+
+
+@lru_cache(maxsize=64)
+def cached_png(kb: int, variant: int) -> bytes:
+    return make_png(kb, variant)
+
+
+def create_app(latency: float = 0.05, image_kb: int = 200) -> FastAPI:
+    """
+    Parameters
+    ----------
+    latency
+        全レスポンスに加える遅延（秒）
+    image_kb
+        画像のおおよそのサイズ（KB）
+    """
+    app = FastAPI(title="standins")
+
+    async def delay(request: Request):
+        await asyncio.sleep(float(request.query_params.get("latency", latency)))
+
+    def image(request: Request, name: str) -> Response:
+        kb = int(request.query_params.get("kb", image_kb))
+        # 名前ごとに内容を変えつつ、生成コストはキャッシュで抑える
+        variant = int(hashlib.sha256(name.encode()).hexdigest(), 16) % 16
+        return Response(cached_png(kb, variant), media_type="image/png")
+
+    @app.api_route("/img/{name}", methods=["GET", "HEAD"])
+    async def img(request: Request, name: str):
+        await delay(request)
+        return image(request, name)
+
+    @app.get("/thumb/{name}")
+    async def thumb(request: Request, name: str):
+        await delay(request)
+        return image(request, name)
+
+    @app.head("/video/{name}")
+    async def video(request: Request, name: str):
+        await delay(request)
+        return Response(media_type="video/mp4")
+
+    @app.get("/youtube/v3/search")
+    async def search(request: Request, q: str, maxResults: int = 20):
+        await delay(request)
+        base = str(request.base_url).rstrip("/")
+        return {
+            "items": [
+                {
+                    "id": {"videoId": f"{q}-{i}"},
+                    "snippet": {
+                        "title": f"{q} #{i}",
+                        "thumbnails": {
+                            "medium": {"url": f"{base}/thumb/{q}-{i}.jpg?kb=20"}
+                        },
+                    },
+                }
+                for i in range(maxResults)
+            ]
+        }
+
+    @app.get("/gist")
+    async def gist(request: Request):
+        await delay(request)
+        base = str(request.base_url).rstrip("/")
+        return Response(
+            "\n".join(f"{base}/video/random-{i}.mp4" for i in range(24)),
+            media_type="text/plain",
+        )
+
+    return app
@@ -1,3 +1,8 @@
 from util.image_stream import ImageStream
 from util.youtube import YouTube
 from util.random import Random
+from util.jobs import Jobs
+from util.proxy import ProxyResolver
+from util.timing import Profiler
+from util.cluster import Cluster
+from util.ratelimit import RateLimiter
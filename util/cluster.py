@@ -0,0 +1,205 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+from typing import Callable
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger("uvicorn")
+
+
+def _hash(value: str) -> int:
+    return int(hashlib.sha256(value.encode()).hexdigest()[:16], 16)
+
+
+class Cluster:
+    """複数ノードでストリームを分担する (consistent hashing)
+
+    stream_key ごとに担当ノードを決め、担当でないノードはリダイレクトする
+    メンバーは静的な設定 (CLUSTER_NODES) で、応答しないノードはリングから外す
+
+    nodes が1つ以下、または self_url が無い場合は無効で、常に自ノードが担当
+    """
+
+    VNODES = 100  # 1ノードあたりの仮想ノード数
+    PROBE_INTERVAL = 5  # seconds
+    PROBE_TIMEOUT = 2.0
+    MAX_FAILURES = 2  # 連続でこの回数失敗したらリングから外す
+
+    def __init__(
+        self, nodes: list[str], self_url: str | None = None, token: str | None = None
+    ):
+        """
+        Parameters
+        ----------
+        nodes
+            全ノードのベースURL (例: http://10.0.0.1:8080)
+        self_url
+            自ノードのベースURL (nodes のどれか)
+        token
+            ノード間のリクエストに付ける共有トークン (CLUSTER_TOKEN)
+        """
+        self.nodes = [node.rstrip("/") for node in nodes]
+        self.self_url = self_url.rstrip("/") if self_url else None
+        self.token = token
+        self.enabled = len(self.nodes) > 1 and self.self_url in self.nodes
+        # 他ノードのホスト (自ノードと同じホストは除く)
+        self.peer_hosts = {urlsplit(node).hostname for node in self.nodes} - {
+            urlsplit(self.self_url or "").hostname
+        }
+        self.failures = {node: 0 for node in self.nodes}
+        self.on_change: Callable[[], None] | None = None
+        self.task: asyncio.Task | None = None
+        self.ring: list[tuple[int, str]] = []
+        self._rebuild()
+
+    @property
+    def alive(self) -> list[str]:
+        return [
+            node
+            for node in self.nodes
+            if node == self.self_url or self.failures[node] < self.MAX_FAILURES
+        ]
+
+    def _rebuild(self):
+        self.ring = sorted(
+            (_hash(f"{node}#{i}"), node)
+            for node in self.alive
+            for i in range(self.VNODES)
+        )
+
+    def owner(self, stream_key: str) -> str | None:
+        """stream_key の担当ノード (無効なら None)
+
+        Examples
+        --------
+        担当はどのノードで計算しても同じで、全ノードに分散する
+        >>> nodes = ["http://10.0.0.1:8080", "http://10.0.0.2:8080", "http://10.0.0.3:8080"]
+        >>> keys = [f"key{i}" for i in range(3000)]
+        >>> owners = {key: Cluster(nodes, nodes[0]).owner(key) for key in keys}
+        >>> owners == {key: Cluster(nodes, nodes[1]).owner(key) for key in keys}
+        True
+        >>> sorted(set(owners.values())) == nodes
+        True
+
+        ノードが外れると、そのノードの担当だったキーだけが移る
+        >>> cluster = Cluster(nodes, nodes[0])
+        >>> for _ in range(Cluster.MAX_FAILURES):
+        ...     cluster.record(nodes[2], ok=False)
+        >>> moved = [key for key in keys if cluster.owner(key) != owners[key]]
+        >>> all(owners[key] == nodes[2] for key in moved)
+        True
+        >>> len(moved) == list(owners.values()).count(nodes[2])
+        True
+
+        戻れば元の担当に戻る
+        >>> cluster.record(nodes[2], ok=True)
+        >>> {key: cluster.owner(key) for key in keys} == owners
+        True
+
+        ノードが1つなら無効
+        >>> Cluster(nodes[:1], nodes[0]).owner("key0") is None
+        True
+        """
+        if not self.enabled or not self.ring:
+            return None
+        idx = bisect.bisect(self.ring, (_hash(stream_key), ""))
+        return self.ring[idx % len(self.ring)][1]
+
+    def owns(self, stream_key: str) -> bool:
+        owner = self.owner(stream_key)
+        return owner is None or owner == self.self_url
+
+    def is_peer(self, url: str) -> bool:
+        """url が他ノードを指しているか"""
+        return any(
+            url.startswith(node + "/") for node in self.nodes if node != self.self_url
+        )
+
+    def is_internal(self, host: str | None, token: str | None) -> bool:
+        """他ノードからのリクエストか
+
+        token が CLUSTER_TOKEN と一致するか、送信元が他ノードのホスト (IP で指定した場合)
+
+        Examples
+        --------
+        >>> nodes = ["http://10.0.0.1:8080", "http://10.0.0.2:8080"]
+        >>> cluster = Cluster(nodes, nodes[0], token="secret")
+        >>> cluster.is_internal("10.0.0.2", None)
+        True
+        >>> cluster.is_internal("192.0.2.1", "secret")
+        True
+        >>> cluster.is_internal("192.0.2.1", None), cluster.is_internal("10.0.0.1", None)
+        (False, False)
+        """
+        if not self.enabled:
+            return False
+        if self.token and token == self.token:
+            return True
+        return host in self.peer_hosts
+
+    def status(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "self": self.self_url,
+            "nodes": [
+                {"url": node, "alive": node in self.alive} for node in self.nodes
+            ],
+        }
+
+    def record(self, node: str, ok: bool):
+        """死活確認の結果を記録し、メンバーが変わればリングを組み直す"""
+        before = self.alive
+        self.failures[node] = 0 if ok else self.failures[node] + 1
+        if self.alive != before:
+            logger.info(f"Cluster membership changed: {before} -> {self.alive}")
+            self._rebuild()
+            if self.on_change is not None:
+                self.on_change()
+
+    async def probe(self):
+        """他ノードの死活を確認する
+
+        Examples
+        --------
+        応答しないノードは MAX_FAILURES 回でリングから外れる
+        >>> nodes = ["http://127.0.0.1:8080", "http://127.0.0.1:9"]
+        >>> cluster = Cluster(nodes, nodes[0])
+        >>> for _ in range(Cluster.MAX_FAILURES):
+        ...     asyncio.run(cluster.probe())
+        >>> cluster.alive
+        ['http://127.0.0.1:8080']
+        >>> cluster.owner("key0")
+        'http://127.0.0.1:8080'
+        """
+        async with httpx.AsyncClient(timeout=self.PROBE_TIMEOUT) as client:
+
+            async def _probe(node: str):
+                try:
+                    response = await client.get(f"{node}/video/cluster")
+                    response.raise_for_status()
+                    self.record(node, ok=True)
+                except httpx.HTTPError:
+                    self.record(node, ok=False)
+
+            await asyncio.gather(
+                *(_probe(node) for node in self.nodes if node != self.self_url)
+            )
+
+    async def _run(self):
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.PROBE_INTERVAL)
+
+    def start(self):
+        """バックグラウンドで死活確認を開始する"""
+        if self.enabled:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
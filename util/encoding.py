@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger("uvicorn")
+
+# エンコード設定のプロファイル
+#   fps: 出力フレームレート
+#   preset, crf: libx264 の設定
+#   gop_seconds: キーフレーム間隔（秒）、HLS のセグメント長も同じにする
+PROFILES = {
+    "default": {"fps": 16, "preset": "ultrafast", "crf": 30, "gop_seconds": 4},
+    # 静止画なので fps を落としても見た目はほぼ変わらない
+    "light": {"fps": 8, "preset": "ultrafast", "crf": 32, "gop_seconds": 4},
+    "tiny": {"fps": 4, "preset": "ultrafast", "crf": 34, "gop_seconds": 6},
+    # CPU を多めに使ってビットレートを下げる
+    "compact": {"fps": 8, "preset": "veryfast", "crf": 30, "gop_seconds": 4},
+    "quality": {"fps": 16, "preset": "veryfast", "crf": 24, "gop_seconds": 4},
+}
+
+
+def load_profiles(path: str | None = None) -> dict:
+    """組み込みのプロファイルに JSON ファイルのプロファイルを加える
+
+    ファイルの各プロファイルは default を上書きする形で書ける
+    {"mine": {"fps": 10, "crf": 28}}
+    """
+    profiles = dict(PROFILES)
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            for name, conf in json.load(f).items():
+                profiles[name] = {**PROFILES["default"], **conf}
+    return profiles
+
+
+def get_profile(name: str | None = None) -> dict:
+    """名前のプロファイル (ENCODING_PROFILE, ENCODING_PROFILES から)"""
+    profiles = load_profiles(os.getenv("ENCODING_PROFILES"))
+    name = name or os.getenv("ENCODING_PROFILE", "default")
+    if name not in profiles:
+        logger.warning(f"Unknown encoding profile {name}, using default")
+        name = "default"
+    return {"name": name, **profiles[name]}
+
+
+def _encoder_args(profile: dict, tune: str | None = None) -> list[str]:
+    fps = profile["fps"]
+    gop_seconds = profile["gop_seconds"]
+    args = ["-c:v", "libx264", "-preset", profile["preset"]]
+    if tune is not None:
+        args += ["-tune", tune]
+    return args + [
+        "-crf",
+        str(profile["crf"]),
+        "-r",
+        str(fps),
+        "-g",
+        str(fps * gop_seconds),  # GOP size
+        "-sc_threshold",
+        "0",
+        "-force_key_frames",
+        f"expr:gte(t,n_forced*{gop_seconds})",
+        "-an",
+    ]
+
+
+def _hls_args(
+    profile: dict, outdir: Path, hls_list_size: int, vod: bool = False
+) -> list[str]:
+    if vod:
+        playlist_args = ["-hls_playlist_type", "vod"]
+    else:
+        playlist_args = ["-hls_flags", "delete_segments+append_list+omit_endlist"]
+    return [
+        "-f",
+        "hls",
+        "-hls_time",
+        str(profile["gop_seconds"]),
+        "-hls_list_size",
+        str(hls_list_size),
+        *playlist_args,
+        "-hls_segment_filename",
+        os.path.join(outdir, "seg_%05d.ts"),
+        str(outdir / "index.m3u8"),
+    ]
+
+
+def image_command(
+    profile: dict,
+    image_path: str,
+    outdir: Path,
+    seconds: int,
+    hls_list_size: int = 6,
+    realtime: bool = True,
+    vod: bool = False,
+) -> list[str]:
+    """静止画1枚の HLS ライブストリームの ffmpeg コマンド
+
+    realtime=False は -re なしで全力でエンコードする (計測用、VOD の作成用)
+    vod=True は終わりのある VOD として書き出す (セグメントを消さない)
+    """
+    fps = profile["fps"]
+    return (
+        ["ffmpeg", "-y"]
+        + (["-re"] if realtime else [])
+        + ["-loop", "1", "-framerate", str(fps), "-i", image_path]
+        + ["-vf", "scale=1280:720,format=yuv420p"]
+        + _encoder_args(profile, tune="stillimage")
+        + ["-t", str(seconds)]
+        + _hls_args(profile, outdir, hls_list_size, vod=vod)
+    )
+
+
+def slideshow_command(
+    profile: dict,
+    concat_file: Path,
+    outdir: Path,
+    seconds: int,
+    hls_list_size: int,
+    realtime: bool = True,
+) -> list[str]:
+    """concat demuxer によるスライドショーの HLS ライブストリームの ffmpeg コマンド"""
+    return (
+        ["ffmpeg", "-y"]
+        + (["-re"] if realtime else [])
+        + ["-f", "concat", "-safe", "0", "-i", str(concat_file)]
+        + [
+            "-vf",
+            "scale=1280:720:force_original_aspect_ratio=decrease,pad=1280:720:(ow-iw)/2:(oh-ih)/2,format=yuv420p",
+        ]
+        + _encoder_args(profile)
+        + ["-t", str(seconds)]
+        + _hls_args(profile, outdir, hls_list_size)
+    )
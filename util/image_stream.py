@@ -2,17 +2,21 @@ import asyncio
 import hashlib
 import json
 import logging
+import math
 import os
 import shutil
 import subprocess
 import tempfile
 import time
 from pathlib import Path
+from typing import Callable
 
 import httpx
 from fastapi import HTTPException
 from fastapi.responses import RedirectResponse
 
+from util import encoding, metrics, timing
+
 logger = logging.getLogger("uvicorn")
 
 
@@ -21,11 +25,44 @@ class ImageStream:
     MAX_NUM_PROCESSES = 4
     BASE_DIR = Path("stream")
 
+    PROFILE = encoding.get_profile()  # ENCODING_PROFILE
+    LOADING_KEY = "loading"
+    LOADING_SECONDS = 12
+
     processes = {}  # stream_key -> {'process': Popen, 'last_access': float}
 
     def __init___(self):
         os.makedirs(str(self.BASE_DIR), exist_ok=True)
 
+    @staticmethod
+    def key(path: str | None = None, url: str | None = None) -> str:
+        """画像のストリームキー"""
+        if path is not None:
+            return hashlib.sha256(path.encode()).hexdigest()
+        if url is not None:
+            return hashlib.sha256(url.encode()).hexdigest()
+        raise ValueError("Either path or url must be provided")
+
+    @staticmethod
+    def slideshow_key(urls: list[str], duration: int, loop_count: int) -> str:
+        """スライドショーのストリームキー（URL順序 + duration + loop_count）"""
+        key_parts = json.dumps(urls) + f"|duration={duration}|loop={loop_count}"
+        return hashlib.sha256(key_parts.encode()).hexdigest()
+
+    def ready(self, stream_key: str) -> bool:
+        """ストリームのプレイリストが存在するか"""
+        return os.path.exists(self.BASE_DIR / stream_key / "index.m3u8")
+
+    def deprioritize(self, predicate: Callable[[str], bool]):
+        """predicate を満たすストリームを次の削除対象にする
+
+        視聴中のプレイヤーのために即座には止めない
+        """
+        for stream_key, process_info in self.processes.items():
+            if predicate(stream_key):
+                logger.info(f"Deprioritized stream: {stream_key}")
+                process_info["last_access"] = 0.0
+
     def _cleanup_old_processes(self):
         """古いストリームの削除
 
@@ -45,6 +82,7 @@ class ImageStream:
         num_to_kill = len(self.processes) - self.MAX_NUM_PROCESSES + 1
         for stream_key, process_info in sorted_processes[:num_to_kill]:
             logger.info(f"Terminating old process for stream: {stream_key}")
+            metrics.STREAM_EVICTIONS.inc()
             try:
                 process_info["process"].terminate()
                 process_info["process"].wait(timeout=5)
@@ -69,6 +107,59 @@ class ImageStream:
 
             del self.processes[stream_key]
 
+    def prepare_loading(self):
+        """構築待ちの間に返す「読み込み中」ストリームを作る
+
+        ./stream/loading/index.m3u8 に LOADING_SECONDS 秒の VOD として書き出す
+        常駐プロセスは持たないので processes には登録しない
+        """
+        outdir = self.BASE_DIR / self.LOADING_KEY
+        if (outdir / "index.m3u8").exists():
+            return
+
+        # 書き出し途中のプレイリストを返さないよう一時ディレクトリで作る
+        tmpdir = self.BASE_DIR / f"{self.LOADING_KEY}.tmp"
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        os.makedirs(str(tmpdir), exist_ok=True)
+        image_path = tmpdir / "loading.png"
+        subprocess.run(
+            [
+                "convert",
+                "-size",
+                "1280x720",
+                "xc:black",
+                "-fill",
+                "white",
+                "-font",
+                "DejaVu-Sans-Bold",
+                "-pointsize",
+                "64",
+                "-gravity",
+                "center",
+                "-annotate",
+                "+0+0",
+                "Loading...",
+                str(image_path),
+            ],
+            check=True,
+        )
+
+        cmd = encoding.image_command(
+            self.PROFILE,
+            str(image_path),
+            tmpdir,
+            self.LOADING_SECONDS,
+            hls_list_size=0,
+            realtime=False,
+            vod=True,
+        )
+        subprocess.run(
+            cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+        )
+        shutil.rmtree(outdir, ignore_errors=True)
+        tmpdir.rename(outdir)
+        logger.info(f"Loading stream ready: {outdir}")
+
     def stream(self, image_path: str, stream_key: str):
         """ffmpeg を用いて HLS ストリームを開始する
 
@@ -86,50 +177,7 @@ class ImageStream:
         outdir = self.BASE_DIR / stream_key
         os.makedirs(str(outdir), exist_ok=True)
 
-        fps = 16
-        cmd = [
-            "ffmpeg",
-            "-y",
-            "-re",
-            "-loop",
-            "1",
-            "-framerate",
-            str(fps),
-            "-i",
-            image_path,
-            "-vf",
-            "scale=1280:720,format=yuv420p",
-            "-c:v",
-            "libx264",
-            "-preset",
-            "ultrafast",
-            "-tune",
-            "stillimage",
-            "-crf",
-            "30",
-            "-r",
-            str(fps),
-            "-g",
-            str(fps * 4),  # GOP size
-            "-sc_threshold",
-            "0",
-            "-force_key_frames",
-            "expr:gte(t,n_forced*4)",
-            "-an",
-            "-t",
-            str(self.MAX_SECONDS),
-            "-f",
-            "hls",
-            "-hls_time",
-            "4",
-            "-hls_list_size",
-            "6",
-            "-hls_flags",
-            "delete_segments+append_list+omit_endlist",
-            "-hls_segment_filename",
-            os.path.join(outdir, "seg_%05d.ts"),
-            str(outdir / "index.m3u8"),
-        ]
+        cmd = encoding.image_command(self.PROFILE, image_path, outdir, self.MAX_SECONDS)
         logger.info(f"Starting HLS stream for: {image_path} -> {stream_key}")
         process = subprocess.Popen(
             cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
@@ -138,6 +186,23 @@ class ImageStream:
         logger.info(f"FFmpeg process started with PID: {process.pid}")
         return process
 
+    @staticmethod
+    def write_concat(
+        outdir: Path, image_paths: list[str], duration: int, loop_count: int
+    ) -> Path:
+        """concat demuxer 用のファイルリストを作成する"""
+        # 画像リストを loop_count 倍に拡張
+        expanded_images = image_paths * loop_count
+
+        concat_file = outdir / "concat.txt"
+        with open(concat_file, "w") as f:
+            for image_path in expanded_images:
+                f.write(f"file '{image_path}'\n")
+                f.write(f"duration {duration}\n")
+            # 最後の画像をもう一度書く（concat demuxer の仕様）
+            f.write(f"file '{expanded_images[-1]}'\n")
+        return concat_file
+
     def stream_slideshow(
         self,
         image_paths: list[str],
@@ -161,70 +226,25 @@ class ImageStream:
         outdir = self.BASE_DIR / stream_key
         os.makedirs(str(outdir), exist_ok=True)
 
-        fps = 16
-
-        # 画像リストを loop_count 倍に拡張
-        expanded_images = image_paths * loop_count
-
-        # concat demuxer 用のファイルリストを作成
-        concat_file = outdir / "concat.txt"
-        with open(concat_file, "w") as f:
-            for image_path in expanded_images:
-                f.write(f"file '{image_path}'\n")
-                f.write(f"duration {duration}\n")
-            # 最後の画像をもう一度書く（concat demuxer の仕様）
-            f.write(f"file '{expanded_images[-1]}'\n")
+        # MAX_SECONDS を超える分のループは再生されないので書かない
+        loop_count = min(
+            loop_count, math.ceil(self.MAX_SECONDS / duration / len(image_paths)) + 1
+        )
+        concat_file = self.write_concat(outdir, image_paths, duration, loop_count)
 
         # hls_list_size を動的に計算（1時間分のセグメント数）
-        # 3600秒 / hls_time(4秒) / duration / 画像枚数
-        hls_list_size = max(int(3600 / 4 / duration / len(image_paths)), 1)
+        # 3600秒 / hls_time / duration / 画像枚数
+        hls_time = self.PROFILE["gop_seconds"]
+        hls_list_size = max(int(3600 / hls_time / duration / len(image_paths)), 1)
         logger.info(
             f"Calculated hls_list_size: {hls_list_size} "
             f"(duration={duration}s, images={len(image_paths)})"
         )
 
         # FFmpegコマンド構築
-        cmd = [
-            "ffmpeg",
-            "-y",
-            "-re",
-            "-f",
-            "concat",
-            "-safe",
-            "0",
-            "-i",
-            str(concat_file),
-            "-vf",
-            "scale=1280:720:force_original_aspect_ratio=decrease,pad=1280:720:(ow-iw)/2:(oh-ih)/2,format=yuv420p",
-            "-c:v",
-            "libx264",
-            "-preset",
-            "ultrafast",
-            "-crf",
-            "30",
-            "-r",
-            str(fps),
-            "-g",
-            str(fps * 4),
-            "-sc_threshold",
-            "0",
-            "-force_key_frames",
-            "expr:gte(t,n_forced*4)",
-            "-an",
-            "-t",
-            str(self.MAX_SECONDS),
-            "-f",
-            "hls",
-            "-hls_time",
-            "4",
-            "-hls_list_size",
-            str(hls_list_size),
-            "-hls_flags",
-            "delete_segments+append_list+omit_endlist",
-            "-hls_segment_filename",
-            os.path.join(outdir, "seg_%05d.ts"),
-            str(outdir / "index.m3u8"),
-        ]
+        cmd = encoding.slideshow_command(
+            self.PROFILE, concat_file, outdir, self.MAX_SECONDS, hls_list_size
+        )
 
         logger.info(f"Starting HLS slideshow stream: {stream_key}")
         logger.debug(f"FFmpeg command: {' '.join(cmd)}")
@@ -253,23 +273,21 @@ class ImageStream:
         if path is None and url is None:
             raise ValueError("Either path or url must be provided")
 
-        stream_key = ""
-        if path is not None:
-            stream_key = hashlib.sha256(path.encode()).hexdigest()
-            logger.info(f"Generated stream key for path {path}: {stream_key}")
-        elif url is not None:
-            stream_key = hashlib.sha256(url.encode()).hexdigest()
-            logger.info(f"Generated stream key for URL {url}: {stream_key}")
+        stream_key = self.key(path=path, url=url)
+        logger.info(f"Generated stream key for {path or url}: {stream_key}")
 
         # cached
-        if os.path.exists(self.BASE_DIR / stream_key / "index.m3u8"):
+        if self.ready(stream_key):
             logger.info(f"Cache hit for stream: {stream_key}")
+            metrics.CACHE_REQUESTS.inc(cache="stream", result="hit")
             if stream_key in self.processes:
                 self.processes[stream_key]["last_access"] = time.time()
             return RedirectResponse(
                 url=f"/video/stream/{stream_key}/index.m3u8", status_code=302
             )
 
+        metrics.CACHE_REQUESTS.inc(cache="stream", result="miss")
+
         # download URL
         if url is not None:
             logger.info(f"Cache miss, downloading from URL: {url}")
@@ -278,8 +296,10 @@ class ImageStream:
             async with httpx.AsyncClient(
                 headers={"user-agent": "curl/7.54.1"}, follow_redirects=True
             ) as client:
-                response = await client.get(url, timeout=2.0)
-                response.raise_for_status()
+                with metrics.IMAGE_DOWNLOAD_SECONDS.time(), timing.span("download"):
+                    response = await client.get(url, timeout=2.0)
+                    response.raise_for_status()
+                metrics.IMAGE_DOWNLOAD_BYTES.observe(len(response.content))
                 with open(path, "wb") as f:
                     f.write(response.content)
 
@@ -287,13 +307,20 @@ class ImageStream:
         assert path is not None, "Something wrong"
 
         logger.info(f"Creating new stream for: {stream_key}")
-        self._cleanup_old_processes()
-        _ = self.stream(path, stream_key)
+        with timing.span("evict"):
+            self._cleanup_old_processes()
+        spawned = time.perf_counter()
+        with timing.span("ffmpeg_spawn"):
+            _ = self.stream(path, stream_key)
         playlist = f"./stream/{stream_key}/index.m3u8"
 
         logger.info(f"Waiting for playlist creation: {playlist}")
-        while not os.path.exists(playlist) or os.path.getsize(playlist) <= 0:
-            await asyncio.sleep(0.1)
+        with timing.span("playlist_wait"):
+            while not os.path.exists(playlist) or os.path.getsize(playlist) <= 0:
+                await asyncio.sleep(0.1)
+        metrics.FFMPEG_READY_SECONDS.observe(
+            time.perf_counter() - spawned, kind="image"
+        )
 
         logger.info(
             f"Playlist ready, redirecting to: /video/stream/{stream_key}/index.m3u8"
@@ -324,20 +351,21 @@ class ImageStream:
         if len(urls) > 10:
             raise ValueError("Slideshow supports maximum 10 images")
 
-        # ストリームキー生成（URL順序 + duration + loop_count）
-        key_parts = json.dumps(urls) + f"|duration={duration}|loop={loop_count}"
-        stream_key = hashlib.sha256(key_parts.encode()).hexdigest()
+        stream_key = self.slideshow_key(urls, duration, loop_count)
         logger.info(f"Generated slideshow stream key: {stream_key}")
 
         # キャッシュチェック
-        if os.path.exists(self.BASE_DIR / stream_key / "index.m3u8"):
+        if self.ready(stream_key):
             logger.info(f"Cache hit for slideshow: {stream_key}")
+            metrics.CACHE_REQUESTS.inc(cache="stream", result="hit")
             if stream_key in self.processes:
                 self.processes[stream_key]["last_access"] = time.time()
             return RedirectResponse(
                 url=f"/video/stream/{stream_key}/index.m3u8", status_code=302
             )
 
+        metrics.CACHE_REQUESTS.inc(cache="stream", result="miss")
+
         # 全画像をダウンロード
         logger.info(f"Cache miss, downloading {len(urls)} images")
         with tempfile.TemporaryDirectory(delete=False) as temp_dir:
@@ -348,8 +376,13 @@ class ImageStream:
                 for idx, url in enumerate(urls):
                     image_path = str(Path(temp_dir) / f"image_{idx:03d}.jpg")
                     try:
-                        response = await client.get(url, timeout=5.0)
-                        response.raise_for_status()
+                        with (
+                            metrics.IMAGE_DOWNLOAD_SECONDS.time(),
+                            timing.span("download"),
+                        ):
+                            response = await client.get(url, timeout=5.0)
+                            response.raise_for_status()
+                        metrics.IMAGE_DOWNLOAD_BYTES.observe(len(response.content))
                         with open(image_path, "wb") as f:
                             f.write(response.content)
                         image_paths.append(image_path)
@@ -362,14 +395,21 @@ class ImageStream:
 
         # スライドショーストリーム作成
         logger.info(f"Creating slideshow stream: {stream_key} (loop={loop_count})")
-        self._cleanup_old_processes()
-        _ = self.stream_slideshow(image_paths, stream_key, duration, loop_count)
+        with timing.span("evict"):
+            self._cleanup_old_processes()
+        spawned = time.perf_counter()
+        with timing.span("ffmpeg_spawn"):
+            _ = self.stream_slideshow(image_paths, stream_key, duration, loop_count)
 
         # プレイリスト作成待ち
         playlist = f"./stream/{stream_key}/index.m3u8"
         logger.info(f"Waiting for playlist creation: {playlist}")
-        while not os.path.exists(playlist) or os.path.getsize(playlist) <= 0:
-            await asyncio.sleep(0.1)
+        with timing.span("playlist_wait"):
+            while not os.path.exists(playlist) or os.path.getsize(playlist) <= 0:
+                await asyncio.sleep(0.1)
+        metrics.FFMPEG_READY_SECONDS.observe(
+            time.perf_counter() - spawned, kind="slideshow"
+        )
 
         logger.info(
             f"Slideshow ready, redirecting to: /video/stream/{stream_key}/index.m3u8"
@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Callable
+
+from fastapi import HTTPException
+
+logger = logging.getLogger("uvicorn")
+
+# ワーカーが実行中のジョブの ID (ジョブの中から自身を待たないように)
+_current: ContextVar[str | None] = ContextVar("job", default=None)
+
+
+class Jobs:
+    """ストリーム等をバックグラウンドで構築するジョブキュー
+
+    同じ job_id のジョブは一つにまとめられる
+    (既定の job_id は spec のハッシュ、ストリームを構築するジョブはストリームキー)
+
+    Examples
+    --------
+    >>> calls = []
+    >>> async def handler(spec):
+    ...     # ジョブの中では自身を構築中とみなさない (自身を待つと終わらない)
+    ...     calls.append((spec["loop"], jobs.building("key")))
+    ...     await asyncio.sleep(0.01)
+    ...     return "/video/stream/key/index.m3u8"
+    >>> jobs = Jobs(handler)
+    >>> async def main():
+    ...     await jobs.start()
+    ...     # 同じキーは spec が違っても実行中のジョブは一つ
+    ...     first = jobs.submit({"loop": 1}, "key")
+    ...     second = jobs.submit({"loop": 5}, "key")
+    ...     print(first == second == "key", jobs.building("key"))
+    ...     job = await jobs.wait("key")
+    ...     print(job["status"], job["result"], calls)
+    ...     # 終了済みのジョブは再登録される
+    ...     jobs.submit({"loop": 5}, "key")
+    ...     job = await jobs.wait("key")
+    ...     print(job["status"], calls)
+    ...     await jobs.stop()
+    >>> asyncio.run(main())
+    True True
+    done /video/stream/key/index.m3u8 [(1, False)]
+    done [(1, False), (5, False)]
+    """
+
+    NUM_WORKERS = 2
+    MAX_JOBS = 256  # 保持するジョブ記録の上限
+
+    def __init__(self, handler: Callable[[dict], Awaitable[str | None]]):
+        """
+        Parameters
+        ----------
+        handler
+            spec を受け取って構築を行う関数
+            リダイレクト先などの結果を返す
+        """
+        self.handler = handler
+        self.jobs = {}  # job_id -> {'spec', 'status', 'result', 'error', ...}
+        self.queue: asyncio.Queue | None = None
+        self.workers = []
+
+    @staticmethod
+    def job_id(spec: dict) -> str:
+        return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+    async def start(self):
+        """ワーカーを起動する"""
+        self.queue = asyncio.Queue()
+        self.workers = [
+            asyncio.create_task(self._worker(i)) for i in range(self.NUM_WORKERS)
+        ]
+        logger.info(f"Started {self.NUM_WORKERS} job workers")
+
+    async def stop(self):
+        """ワーカーを停止する"""
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def submit(
+        self, spec: dict, job_id: str | None = None, kind: str | None = None
+    ) -> str:
+        """ジョブを登録する
+
+        実行待ち・実行中の同じジョブがあれば何もしない (kind だけ付け替える)
+        終了済みのジョブは再登録する (構築済みならキャッシュヒットで即座に終わる)
+
+        Parameters
+        ----------
+        kind
+            ジョブの種類 (例: "prewarm")、状態一覧の絞り込みに使う
+        """
+        if self.queue is None:
+            raise RuntimeError("Jobs is not started")
+        job_id = job_id or self.job_id(spec)
+        if self.building(job_id):
+            if kind is not None:
+                self.jobs[job_id]["kind"] = kind
+            return job_id
+
+        self._forget_old_jobs()
+        self.jobs[job_id] = {
+            "id": job_id,
+            "spec": spec,
+            "kind": kind,
+            "status": "queued",
+            "result": None,
+            "error": None,
+            "created": time.time(),
+            "finished": None,
+        }
+        self.queue.put_nowait(job_id)
+        logger.info(f"Job queued: {job_id} {spec}")
+        return job_id
+
+    def status(self, job_id: str) -> dict | None:
+        return self.jobs.get(job_id)
+
+    def building(self, job_id: str) -> bool:
+        """実行待ち・実行中のジョブがあるか (そのジョブ自身の中では False)"""
+        job = self.jobs.get(job_id)
+        return (
+            job is not None
+            and job["status"] in ("queued", "running")
+            and _current.get() != job_id
+        )
+
+    async def wait(self, job_id: str) -> dict | None:
+        """ジョブが終わるまで待つ"""
+        while self.building(job_id):
+            await asyncio.sleep(0.1)
+        return self.jobs.get(job_id)
+
+    def _forget_old_jobs(self):
+        """終了済みのジョブ記録を古い順に削除する"""
+        if len(self.jobs) < self.MAX_JOBS:
+            return
+        finished = sorted(
+            (job for job in self.jobs.values() if job["finished"] is not None),
+            key=lambda job: job["finished"],
+        )
+        for job in finished[: len(self.jobs) - self.MAX_JOBS + 1]:
+            del self.jobs[job["id"]]
+
+    async def _worker(self, idx: int):
+        assert self.queue is not None
+        while True:
+            job_id = await self.queue.get()
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            job["status"] = "running"
+            logger.info(f"Job running on worker#{idx}: {job_id}")
+            token = _current.set(job_id)
+            try:
+                job["result"] = await self.handler(job["spec"])
+                job["status"] = "done"
+                logger.info(f"Job done: {job_id}")
+            except HTTPException as e:
+                job["status"] = "failed"
+                job["error"] = e.detail
+                logger.warning(f"Job failed: {job_id}: {e.detail}")
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = str(e)
+                logger.error(f"Job failed: {job_id}: {e}")
+            finally:
+                _current.reset(token)
+                job["finished"] = time.time()
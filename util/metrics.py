@@ -0,0 +1,226 @@
+"""Prometheus 形式のメトリクス
+
+依存を増やさないよう text exposition format を直接書き出す
+"""
+
+import bisect
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+REGISTRY: list["Metric"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return "{" + body + "}"
+
+
+class Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values = {}  # tuple(sorted(labels.items())) -> value
+        REGISTRY.append(self)
+
+    def clear(self):
+        self.values = {}
+
+    def samples(self):
+        """(suffix, labels, value) を列挙する"""
+        for key, value in self.values.items():
+            yield "", dict(key), value
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.TYPE}",
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_labels(labels)} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+    BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name: str, help: str, buckets: tuple | None = None):
+        super().__init__(name, help)
+        self.buckets = buckets or self.BUCKETS
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        if key not in self.values:
+            self.values[key] = {
+                "buckets": [0] * len(self.buckets),
+                "sum": 0.0,
+                "count": 0,
+            }
+        entry = self.values[key]
+        idx = bisect.bisect_left(self.buckets, value)
+        if idx < len(self.buckets):
+            entry["buckets"][idx] += 1
+        entry["sum"] += value
+        entry["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """ブロックの経過時間（秒）を記録する"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, entry in self.values.items():
+            labels = dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry["buckets"]):
+                cumulative += count
+                yield "_bucket", {**labels, "le": bound}, cumulative
+            yield "_bucket", {**labels, "le": "+Inf"}, entry["count"]
+            yield "_sum", labels, entry["sum"]
+            yield "_count", labels, entry["count"]
+
+
+URL_TYPE_SECONDS = Histogram(
+    "video_url_type_seconds", "Latency of UrlType.from_url (incl. HEAD probe)"
+)
+REDIRECT_SECONDS = Histogram(
+    "video_redirect_seconds", "End-to-end time to redirect, per url type"
+)
+IMAGE_DOWNLOAD_SECONDS = Histogram(
+    "video_image_download_seconds", "Time to download a source image"
+)
+IMAGE_DOWNLOAD_BYTES = Histogram(
+    "video_image_download_bytes",
+    "Size of downloaded source images",
+    buckets=(1e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7),
+)
+FFMPEG_READY_SECONDS = Histogram(
+    "video_ffmpeg_ready_seconds", "Time from ffmpeg spawn to playlist ready"
+)
+CACHE_REQUESTS = Counter(
+    "video_cache_requests_total", "Cache lookups by cache and result (hit/miss)"
+)
+STREAM_EVICTIONS = Counter(
+    "video_stream_evictions_total", "Streams terminated to make room for new ones"
+)
+RATE_LIMITED = Counter(
+    "video_rate_limited_total", "Requests rejected with 429, per operation"
+)
+FFMPEG_PROCESSES = Gauge("video_ffmpeg_processes", "Live ffmpeg processes")
+FFMPEG_CPU_SECONDS = Gauge(
+    "video_ffmpeg_cpu_seconds", "CPU time (user+system) of each ffmpeg process"
+)
+FFMPEG_RSS_BYTES = Gauge(
+    "video_ffmpeg_rss_bytes", "Resident memory of each ffmpeg process"
+)
+DISK_USAGE_BYTES = Gauge("video_disk_usage_bytes", "Disk usage per directory")
+
+
+def proc_stats(pid: int) -> tuple[float, int] | None:
+    """/proc から (CPU秒, RSSバイト) を読む
+
+    読めない (プロセスが終了した, Linux 以外) 場合は None
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # comm に空白が含まれうるので ")" 以降を分割する
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    # fields[0] が state (stat の3番目), utime/stime は14/15番目
+    utime, stime = int(fields[11]), int(fields[12])
+    return (utime + stime) / CLOCK_TICKS, rss_pages * PAGE_SIZE
+
+
+def disk_usage(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def collect(processes: dict, dirs: list[Path]) -> dict:
+    """ffmpeg プロセスの /proc とディスク使用量を読む
+
+    ファイルを読むだけなのでスレッドで実行できる
+    (メトリクスはイベントループで更新されるので、ここでは触らない)
+
+    Parameters
+    ----------
+    processes
+        ImageStream.processes
+    dirs
+        ディスク使用量を測るディレクトリ
+    """
+    live = []
+    for stream_key, process_info in list(processes.items()):
+        process = process_info["process"]
+        if process.poll() is not None:
+            continue
+        live.append((stream_key, process.pid, proc_stats(process.pid)))
+    return {
+        "processes": live,
+        "disk": [(path, disk_usage(path)) for path in dirs],
+    }
+
+
+def render(collected: dict) -> str:
+    """全メトリクスを書き出す (イベントループで実行する)
+
+    Parameters
+    ----------
+    collected
+        collect の結果
+    """
+    FFMPEG_CPU_SECONDS.clear()
+    FFMPEG_RSS_BYTES.clear()
+    for stream_key, pid, stats in collected["processes"]:
+        if stats is None:
+            continue
+        cpu, rss = stats
+        FFMPEG_CPU_SECONDS.set(cpu, stream=stream_key, pid=pid)
+        FFMPEG_RSS_BYTES.set(rss, stream=stream_key, pid=pid)
+    FFMPEG_PROCESSES.set(len(collected["processes"]))
+
+    for path, usage in collected["disk"]:
+        DISK_USAGE_BYTES.set(usage, path=str(path))
+
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
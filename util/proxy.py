@@ -0,0 +1,247 @@
+import asyncio
+import json
+import logging
+import time
+
+import httpx
+
+logger = logging.getLogger("uvicorn")
+
+
+class Backend:
+    """変換先のプロキシ
+
+    template には {url} (元のURL) と {video_id} (URL末尾のID) が使える
+    """
+
+    ALPHA = 0.3  # レイテンシの指数移動平均の係数
+    MAX_FAILURES = 3  # 連続でこの回数失敗したら unhealthy
+
+    def __init__(self, name: str, template: str, probe: str):
+        self.name = name
+        self.template = template
+        self.probe = probe
+        self.latency: float | None = None  # 秒 (指数移動平均)
+        self.failures = 0  # 連続失敗回数
+        self.checked: float | None = None
+
+    @property
+    def healthy(self) -> bool:
+        return self.failures < self.MAX_FAILURES
+
+    def format(self, url: str) -> str:
+        video_id = url.split("/")[-1].split("?")[0]
+        return self.template.format(url=url, video_id=video_id)
+
+    def record(self, latency: float | None):
+        """プローブ結果を記録する (失敗なら latency=None)
+
+        Examples
+        --------
+        レイテンシは指数移動平均
+        >>> backend = Backend("proxy", "https://proxy/?{url}", "https://proxy/")
+        >>> backend.record(1.0)
+        >>> backend.record(0.0)
+        >>> round(backend.latency, 2)
+        0.7
+
+        連続で MAX_FAILURES 回失敗すると unhealthy、成功すれば戻る
+        >>> for _ in range(Backend.MAX_FAILURES):
+        ...     backend.record(None)
+        >>> backend.healthy
+        False
+        >>> backend.record(0.7)
+        >>> backend.healthy, backend.failures
+        (True, 0)
+        """
+        self.checked = time.time()
+        if latency is None:
+            self.failures += 1
+            return
+        self.failures = 0
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = self.ALPHA * latency + (1 - self.ALPHA) * self.latency
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "latency": self.latency,
+            "failures": self.failures,
+            "checked": self.checked,
+        }
+
+
+class ProxyResolver:
+    """動画URLをプラットフォームごとのプロキシに変換する
+
+    プラットフォームごとに複数の候補を持ち、
+    バックグラウンドのプローブで測ったレイテンシが最小の healthy な候補を使う
+    プローブ前は表の順序で先頭の候補を使う
+    """
+
+    PROBE_INTERVAL = 60  # seconds
+    PROBE_TIMEOUT = 3.0
+
+    DEFAULT_TABLE = {
+        "backends": {
+            "nicovideo.life": {
+                "template": "https://www.nicovideo.life/watch?v={video_id}",
+                "probe": "https://www.nicovideo.life/",
+            },
+            "biliplayer": {
+                "template": "https://biliplayer.91vrchat.com/player/?url={url}",
+                "probe": "https://biliplayer.91vrchat.com/",
+            },
+            "nicovrc": {
+                "template": "https://nicovrc.net/proxy/?{url}",
+                "probe": "https://nicovrc.net/",
+            },
+        },
+        "platforms": [
+            {
+                "name": "nicovideo",
+                "match": ["nicovideo.jp/watch/"],
+                "backends": ["nicovideo.life", "nicovrc"],
+            },
+            {
+                "name": "bilibili",
+                "match": ["bilibili.com/video/"],
+                "backends": ["biliplayer", "nicovrc"],
+            },
+            {
+                "name": "iwara",
+                "match": ["iwara.tv/video/"],
+                "backends": ["nicovrc"],
+            },
+            {
+                "name": "x",
+                "match": ["x.com/"],
+                "backends": ["nicovrc"],
+            },
+        ],
+    }
+
+    def __init__(self, table: dict | None = None):
+        """
+        Parameters
+        ----------
+        table
+            {"backends": {name: {"template", "probe"}},
+             "platforms": [{"name", "match": [...], "backends": [name, ...]}]}
+            platforms は先頭から順に match を部分文字列として判定する
+        """
+        table = table or self.DEFAULT_TABLE
+        self.backends = {
+            name: Backend(name, conf["template"], conf["probe"])
+            for name, conf in table["backends"].items()
+        }
+        self.platforms = table["platforms"]
+        self.task: asyncio.Task | None = None
+
+    @classmethod
+    def load(cls, path: str) -> "ProxyResolver":
+        """JSON ファイルから表を読み込む"""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def platform(self, url: str) -> dict | None:
+        for platform in self.platforms:
+            if any(pattern in url for pattern in platform["match"]):
+                return platform
+        return None
+
+    def best(self, platform: dict) -> Backend:
+        """healthy な候補のうち最速のもの
+
+        全て unhealthy なら連続失敗が最も少ないもの
+
+        Examples
+        --------
+        プローブ前は表の先頭
+        >>> resolver = ProxyResolver()
+        >>> nicovideo = resolver.platform("https://www.nicovideo.jp/watch/sm9")
+        >>> resolver.best(nicovideo).name
+        'nicovideo.life'
+
+        失敗が記録されると次の候補に切り替わる
+        >>> for _ in range(Backend.MAX_FAILURES):
+        ...     resolver.backends["nicovideo.life"].record(None)
+        >>> resolver.best(nicovideo).name
+        'nicovrc'
+        >>> resolver.resolve("https://www.nicovideo.jp/watch/sm9")
+        'https://nicovrc.net/proxy/?https://www.nicovideo.jp/watch/sm9'
+
+        回復すればレイテンシ (指数移動平均) が最小のものを選ぶ
+        >>> resolver.backends["nicovideo.life"].record(0.5)
+        >>> resolver.backends["nicovrc"].record(0.1)
+        >>> resolver.best(nicovideo).name
+        'nicovrc'
+        >>> for _ in range(10):
+        ...     resolver.backends["nicovideo.life"].record(0.05)
+        >>> resolver.best(nicovideo).name
+        'nicovideo.life'
+        """
+        candidates = [self.backends[name] for name in platform["backends"]]
+        healthy = [backend for backend in candidates if backend.healthy]
+        if not healthy:
+            return min(candidates, key=lambda backend: backend.failures)
+        # 直近で失敗しているもの・未計測のものは後ろ、同順位は表の順序
+        return min(
+            healthy,
+            key=lambda backend: (
+                backend.failures,
+                backend.latency is None,
+                backend.latency or 0.0,
+            ),
+        )
+
+    def resolve(self, url: str) -> str:
+        """URL を変換する (該当プラットフォームが無ければそのまま)"""
+        platform = self.platform(url)
+        if platform is None:
+            return url
+        return self.best(platform).format(url)
+
+    def status(self) -> list[dict]:
+        return [backend.status() for backend in self.backends.values()]
+
+    async def probe(self):
+        """全候補に一度ずつリクエストしてレイテンシを記録する"""
+        async with httpx.AsyncClient(
+            timeout=self.PROBE_TIMEOUT, follow_redirects=True
+        ) as client:
+
+            async def _probe(backend: Backend):
+                start = time.perf_counter()
+                try:
+                    response = await client.head(backend.probe)
+                    if response.status_code >= 500:
+                        raise httpx.HTTPStatusError(
+                            f"Server error {response.status_code}",
+                            request=response.request,
+                            response=response,
+                        )
+                    backend.record(time.perf_counter() - start)
+                except httpx.HTTPError as e:
+                    logger.warning(f"Proxy probe failed: {backend.name}: {e}")
+                    backend.record(None)
+
+            await asyncio.gather(*(_probe(b) for b in self.backends.values()))
+
+    async def _run(self):
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.PROBE_INTERVAL)
+
+    def start(self):
+        """バックグラウンドでプローブを開始する"""
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
@@ -1,3 +1,4 @@
+import os
 import random
 from datetime import datetime, timezone
 
@@ -11,7 +12,10 @@ class Random:
     """
 
     def __init__(self):
-        self.url = "https://gist.githubusercontent.com/cympfh/653f299d9c748aa78b1a800f2bfa5221/raw/random-videos"
+        self.url = os.getenv(
+            "RANDOM_VIDEOS_URL",
+            "https://gist.githubusercontent.com/cympfh/653f299d9c748aa78b1a800f2bfa5221/raw/random-videos",
+        )
 
     async def get(self):
         async with httpx.AsyncClient() as client:
@@ -0,0 +1,174 @@
+import json
+import logging
+import math
+import time
+from contextvars import ContextVar
+
+from fastapi import HTTPException
+
+from util import metrics
+
+logger = logging.getLogger("uvicorn")
+
+# 現在のリクエストのクライアント (IP)
+# リクエスト外 (バックグラウンドのジョブ等) では None で、制限しない
+client: ContextVar[str | None] = ContextVar("client", default=None)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        """
+        Parameters
+        ----------
+        rate
+            1秒あたりに回復するトークン数
+        burst
+            トークンの上限
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        # now がバケットの作成より前のこともある (RateLimiter.check)
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated = max(self.updated, now)
+
+    def wait(self, now: float) -> float:
+        """トークンが1つ使えるまでの秒数 (使えるなら 0)
+
+        Examples
+        --------
+        >>> bucket = TokenBucket(rate=0.5, burst=2)
+        >>> now = bucket.updated
+        >>> bucket.wait(now)
+        0.0
+        >>> bucket.take()
+        >>> bucket.take()
+        >>> bucket.wait(now)
+        2.0
+
+        時間とともに rate で回復する
+        >>> bucket.wait(now + 1)
+        1.0
+        >>> bucket.wait(now + 2)
+        0.0
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    @property
+    def full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+
+class RateLimiter:
+    """重い操作ごとの、クライアント別と全体のトークンバケット
+
+    キャッシュヒットや動画のリダイレクトには使わない
+    """
+
+    # op -> {"client": (rate, burst), "global": (rate, burst)}
+    LIMITS = {
+        # 新しいストリームの作成 (ダウンロード + ffmpeg の起動 + 他のストリームの削除)
+        # 1クライアントで全ストリームを入れ替えられないよう、
+        # バーストは ImageStream.MAX_NUM_PROCESSES (4) 未満にする
+        "stream": {"client": (1 / 10, 3), "global": (1 / 2, 10)},
+        # YouTube Data API の検索 (1回100ユニット、既定のクォータは1日10000ユニット)
+        "search": {"client": (1 / 60, 5), "global": (90 / 86400, 10)},
+        # ImageMagick による検索結果画像の作成
+        "grid": {"client": (1 / 30, 3), "global": (1 / 5, 5)},
+    }
+    MAX_CLIENTS = 10000  # これを超えたら満タンのバケットを捨てる
+
+    def __init__(self, limits: dict | None = None):
+        self.limits = limits or self.LIMITS
+        self.global_buckets = {
+            op: TokenBucket(*limit["global"]) for op, limit in self.limits.items()
+        }
+        self.client_buckets = {}  # (op, client) -> TokenBucket
+
+    @classmethod
+    def load(cls, path: str) -> "RateLimiter":
+        """JSON ファイルで LIMITS を上書きする
+
+        {"search": {"client": [0.01, 3], "global": [0.1, 10]}}
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            limits = {**cls.LIMITS, **json.load(f)}
+        return cls(limits)
+
+    def _client_bucket(self, op: str, name: str) -> TokenBucket:
+        key = (op, name)
+        if key not in self.client_buckets:
+            if len(self.client_buckets) >= self.MAX_CLIENTS:
+                self.client_buckets = {
+                    k: bucket
+                    for k, bucket in self.client_buckets.items()
+                    if not bucket.full
+                }
+            self.client_buckets[key] = TokenBucket(*self.limits[op]["client"])
+        return self.client_buckets[key]
+
+    def check(self, *ops: str):
+        """ops をまとめて1回ずつ消費する
+
+        どれか一つでも足りなければ何も消費せず 429 (Retry-After 付き)
+        リクエスト外では何もしない
+
+        Examples
+        --------
+        >>> limiter = RateLimiter(
+        ...     {
+        ...         "stream": {"client": (1 / 10, 1), "global": (1, 10)},
+        ...         "grid": {"client": (1 / 30, 2), "global": (1, 10)},
+        ...     }
+        ... )
+
+        リクエスト外 (client が None) は制限しない
+        >>> limiter.check("stream")
+        >>> limiter.check("stream")
+
+        >>> token = client.set("192.0.2.1")
+        >>> limiter.check("stream", "grid")
+        >>> try:
+        ...     limiter.check("stream", "grid")
+        ... except HTTPException as e:
+        ...     print(e.status_code, e.headers)
+        429 {'Retry-After': '10'}
+
+        拒否されたときは grid も消費していない
+        >>> limiter.check("grid")
+
+        クライアントごとのバケットは別
+        >>> _ = client.set("192.0.2.2")
+        >>> limiter.check("stream")
+        >>> client.reset(token)
+        """
+        name = client.get()
+        if name is None or not ops:
+            return
+        now = time.monotonic()
+        buckets = []
+        for op in ops:
+            buckets += [self.global_buckets[op], self._client_bucket(op, name)]
+        wait = max(bucket.wait(now) for bucket in buckets)
+        if wait > 0:
+            logger.warning(f"Rate limited: client={name} ops={ops} wait={wait:.1f}s")
+            for op in ops:
+                metrics.RATE_LIMITED.inc(op=op)
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+        for bucket in buckets:
+            bucket.take()
@@ -0,0 +1,112 @@
+"""リクエストごとの処理段階の計測とサンプリングプロファイラ"""
+
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# 現在のリクエストの [(段階名, 秒), ...]
+# リクエスト外 (バックグラウンドのジョブ等) では None で、計測しない
+_spans: ContextVar[list | None] = ContextVar("spans", default=None)
+
+
+def begin():
+    """リクエストの計測を開始する (reset 用のトークンを返す)"""
+    return _spans.set([])
+
+
+def end(token) -> list[tuple[str, float]]:
+    """リクエストの計測を終了し、記録された段階を返す"""
+    spans = _spans.get() or []
+    _spans.reset(token)
+    return spans
+
+
+def record(name: str, seconds: float):
+    """段階 name の経過時間を記録する"""
+    spans = _spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+@contextmanager
+def span(name: str):
+    """ブロックの経過時間を段階 name として記録する"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def server_timing(spans: list[tuple[str, float]], total: float) -> str:
+    """Server-Timing ヘッダの値
+
+    同じ段階が複数回あれば合計する (スライドショーのダウンロード等)
+
+    Examples
+    --------
+    >>> server_timing([("download", 0.1), ("download", 0.2), ("ffmpeg", 0.05)], 0.5)
+    'download;dur=300.0, ffmpeg;dur=50.0, total;dur=500.0'
+    """
+    durations = {}
+    for name, seconds in spans:
+        durations[name] = durations.get(name, 0.0) + seconds
+    durations["total"] = total
+    return ", ".join(
+        f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items()
+    )
+
+
+def logfmt(fields: dict) -> str:
+    """key=value 形式 (値に空白があればクォート)
+
+    Examples
+    --------
+    >>> logfmt({"path": "/video", "status": 302, "ms": 1.5})
+    'path=/video status=302 ms=1.5'
+    """
+    return " ".join(
+        f'{k}="{v}"' if " " in str(v) else f"{k}={v}" for k, v in fields.items()
+    )
+
+
+class Profiler:
+    """指定スレッドのスタックを一定間隔でサンプリングするプロファイラ
+
+    イベントループのスレッドを対象にするので、同時に処理中の
+    他のリクエストのスタックも混ざりうる
+    """
+
+    INTERVAL = 0.005  # seconds
+    MAX_DEPTH = 64
+
+    def __init__(self, thread_id: int | None = None):
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> list[tuple[str, int]]:
+        """サンプリングを止め、折り畳んだスタックを多い順に返す"""
+        self._stop.set()
+        self._thread.join()
+        return self.stacks.most_common()
+
+    def _run(self):
+        while not self._stop.wait(self.INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < self.MAX_DEPTH:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
@@ -9,8 +9,13 @@ from typing import Dict, List, Optional
 
 import httpx
 
+from util import metrics, timing
+
 
 class YouTube:
+    CACHE_DIR = Path("cache")
+    CACHE_SECONDS = 3600  # 1時間
+
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key or os.getenv("YOUTUBE_API_KEY")
         if not self.api_key:
@@ -18,10 +23,12 @@ class YouTube:
                 "YouTube API key is required. Set YOUTUBE_API_KEY environment variable."
             )
 
-        self.base_url = "https://www.googleapis.com/youtube/v3"
+        self.base_url = os.getenv(
+            "YOUTUBE_API_BASE", "https://www.googleapis.com/youtube/v3"
+        )
 
         # キャッシュディレクトリの作成
-        self.cache_dir = Path("cache")
+        self.cache_dir = self.CACHE_DIR
         self.cache_dir.mkdir(exist_ok=True)
 
     async def search(self, keyword: str, limit: int = 6) -> List[Dict[str, str]]:
@@ -40,15 +47,14 @@ class YouTube:
             [{"title": str, "url": str, "thumbnail": str}, ...]
         """
         print(f"Searching YouTube for: {keyword}")
-        # キャッシュキーを作成（キーワードのハッシュ）
-        cache_key = hashlib.sha256(keyword.encode()).hexdigest()
-        cache_file = self.cache_dir / f"yt_search_{cache_key}.json"
+        cache_file = self.search_path(keyword)
 
         # キャッシュファイルが存在し、一定時間以内の場合は読み込んで返す
         if cache_file.exists():
             file_mtime = cache_file.stat().st_mtime
             current_time = time.time()
-            if current_time - file_mtime < 3600:  # 1時間以内
+            if current_time - file_mtime < self.CACHE_SECONDS:
+                metrics.CACHE_REQUESTS.inc(cache="youtube_search", result="hit")
                 with open(cache_file, "r", encoding="utf-8") as f:
                     cached_results = json.load(f)
                     return cached_results[:limit]
@@ -56,6 +62,8 @@ class YouTube:
                 # 古いキャッシュを削除
                 cache_file.unlink()
 
+        metrics.CACHE_REQUESTS.inc(cache="youtube_search", result="miss")
+
         # APIから検索結果を取得
         params = {
             "part": "snippet",
@@ -66,8 +74,9 @@ class YouTube:
         }
 
         async with httpx.AsyncClient() as client:
-            response = await client.get(f"{self.base_url}/search", params=params)
-            response.raise_for_status()
+            with timing.span("search_api"):
+                response = await client.get(f"{self.base_url}/search", params=params)
+                response.raise_for_status()
 
             data = response.json()
             results = []
@@ -118,6 +127,28 @@ class YouTube:
 
         return results[index]
 
+    @classmethod
+    def search_path(cls, keyword: str) -> Path:
+        """検索結果のキャッシュのパス (cache/yt_search_{keyword_hash}.json)"""
+        # キャッシュキーを作成（キーワードのハッシュ）
+        cache_key = hashlib.sha256(keyword.encode()).hexdigest()
+        return cls.CACHE_DIR / f"yt_search_{cache_key}.json"
+
+    @classmethod
+    def is_cached(cls, path: Path) -> bool:
+        """キャッシュファイルが存在し、CACHE_SECONDS 以内のものか"""
+        try:
+            return time.time() - path.stat().st_mtime < cls.CACHE_SECONDS
+        except FileNotFoundError:
+            return False
+
+    @classmethod
+    def search_result_path(cls, keyword: str) -> Path:
+        """検索結果画像のパス (cache/yt_search_{keyword_hash}.png)"""
+        # キャッシュキーを作成（キーワードのハッシュ）
+        cache_key = hashlib.sha256(keyword.encode()).hexdigest()
+        return cls.CACHE_DIR / f"yt_search_{cache_key}.png"
+
     async def search_result(self, keyword: str) -> str:
         """YouTube検索結果を取得
 
@@ -133,21 +164,22 @@ class YouTube:
         str
             検索結果の画像パス (cache/yt_search_{keyword_hash}.png)
         """
-        # キャッシュキーを作成（キーワードのハッシュ）
-        cache_key = hashlib.sha256(keyword.encode()).hexdigest()
-        result_image = self.cache_dir / f"yt_search_{cache_key}.png"
+        result_image = self.search_result_path(keyword)
 
         # キャッシュファイルが存在し、一定時間以内の場合はそのパスを返す
         if result_image.exists():
             # ファイルの作成時刻をチェック
             file_mtime = result_image.stat().st_mtime
             current_time = time.time()
-            if current_time - file_mtime < 3600:  # 1時間以内
+            if current_time - file_mtime < self.CACHE_SECONDS:
+                metrics.CACHE_REQUESTS.inc(cache="search_result", result="hit")
                 return str(result_image)
             else:
                 # 古いキャッシュを削除
                 result_image.unlink()
 
+        metrics.CACHE_REQUESTS.inc(cache="search_result", result="miss")
+
         # YouTube検索を実行
         results = await self.search(keyword, limit=9)
 
@@ -157,119 +189,127 @@ class YouTube:
             thumbnail_files = []
 
             # 各サムネイルをダウンロード
-            async with httpx.AsyncClient() as client:
-                for i, result in enumerate(results):
-                    thumbnail_url = result["thumbnail"]
-                    thumb_file = temp_path / f"thumb_{i}.jpg"
+            with timing.span("thumbnails"):
+                async with httpx.AsyncClient() as client:
+                    for i, result in enumerate(results):
+                        thumbnail_url = result["thumbnail"]
+                        thumb_file = temp_path / f"thumb_{i}.jpg"
 
-                    response = await client.get(thumbnail_url)
-                    response.raise_for_status()
+                        response = await client.get(thumbnail_url)
+                        response.raise_for_status()
 
-                    with open(thumb_file, "wb") as f:
-                        f.write(response.content)
+                        with open(thumb_file, "wb") as f:
+                            f.write(response.content)
 
-                    thumbnail_files.append(str(thumb_file))
+                        thumbnail_files.append(str(thumb_file))
 
             # 不足分を透明画像で埋める（9個未満の場合）
-            while len(thumbnail_files) < 9:
-                empty_file = temp_path / f"empty_{len(thumbnail_files)}.png"
-                # 320x180の透明画像を作成
+            with timing.span("grid"):
+                while len(thumbnail_files) < 9:
+                    empty_file = temp_path / f"empty_{len(thumbnail_files)}.png"
+                    # 320x180の透明画像を作成
+                    subprocess.run(
+                        [
+                            "convert",
+                            "-size",
+                            "320x180",
+                            "xc:transparent",
+                            str(empty_file),
+                        ],
+                        check=True,
+                    )
+                    thumbnail_files.append(str(empty_file))
+
+                # ImageMagickで2x3グリッドに配置
+                # まず各画像を320x180にリサイズし、下部に番号を追加
+                numbered_files = []
+                for i, thumb_file in enumerate(thumbnail_files):
+                    numbered_file = temp_path / f"numbered_{i}.png"
+
+                    # 画像をリサイズして番号を追加
+                    subprocess.run(
+                        [
+                            "convert",
+                            thumb_file,
+                            "-resize",
+                            "320x180!",
+                            "-gravity",
+                            "south",
+                            "-stroke",
+                            "black",
+                            "-strokewidth",
+                            "2",
+                            "-fill",
+                            "white",
+                            "-font",
+                            "DejaVu-Sans-Bold",  # システムフォントを指定
+                            "-pointsize",
+                            "24",
+                            "-annotate",
+                            "+0+10",
+                            str(i),
+                            str(numbered_file),
+                        ],
+                        capture_output=True,
+                    )
+                    numbered_files.append(str(numbered_file))
+
+                # 3x3グリッドに配置（横3列、縦3行）
+                # まず各行を作成
+                row1_file = temp_path / "row1.png"
+                row2_file = temp_path / "row2.png"
+                row3_file = temp_path / "row3.png"
+
+                # 1行目（0, 1, 2を横に結合）
                 subprocess.run(
-                    ["convert", "-size", "320x180", "xc:transparent", str(empty_file)],
+                    [
+                        "convert",
+                        numbered_files[0],
+                        numbered_files[1],
+                        numbered_files[2],
+                        "+append",
+                        str(row1_file),
+                    ],
                     check=True,
                 )
-                thumbnail_files.append(str(empty_file))
 
-            # ImageMagickで2x3グリッドに配置
-            # まず各画像を320x180にリサイズし、下部に番号を追加
-            numbered_files = []
-            for i, thumb_file in enumerate(thumbnail_files):
-                numbered_file = temp_path / f"numbered_{i}.png"
-
-                # 画像をリサイズして番号を追加
+                # 2行目（3, 4, 5を横に結合）
                 subprocess.run(
                     [
                         "convert",
-                        thumb_file,
-                        "-resize",
-                        "320x180!",
-                        "-gravity",
-                        "south",
-                        "-stroke",
-                        "black",
-                        "-strokewidth",
-                        "2",
-                        "-fill",
-                        "white",
-                        "-font",
-                        "DejaVu-Sans-Bold",  # システムフォントを指定
-                        "-pointsize",
-                        "24",
-                        "-annotate",
-                        "+0+10",
-                        str(i),
-                        str(numbered_file),
+                        numbered_files[3],
+                        numbered_files[4],
+                        numbered_files[5],
+                        "+append",
+                        str(row2_file),
                     ],
-                    capture_output=True,
+                    check=True,
                 )
-                numbered_files.append(str(numbered_file))
-
-            # 3x3グリッドに配置（横3列、縦3行）
-            # まず各行を作成
-            row1_file = temp_path / "row1.png"
-            row2_file = temp_path / "row2.png"
-            row3_file = temp_path / "row3.png"
-
-            # 1行目（0, 1, 2を横に結合）
-            subprocess.run(
-                [
-                    "convert",
-                    numbered_files[0],
-                    numbered_files[1],
-                    numbered_files[2],
-                    "+append",
-                    str(row1_file),
-                ],
-                check=True,
-            )
-
-            # 2行目（3, 4, 5を横に結合）
-            subprocess.run(
-                [
-                    "convert",
-                    numbered_files[3],
-                    numbered_files[4],
-                    numbered_files[5],
-                    "+append",
-                    str(row2_file),
-                ],
-                check=True,
-            )
 
-            # 3行目（6, 7, 8を横に結合）
-            subprocess.run(
-                [
-                    "convert",
-                    numbered_files[6],
-                    numbered_files[7],
-                    numbered_files[8],
-                    "+append",
-                    str(row3_file),
-                ],
-                check=True,
-            )
+                # 3行目（6, 7, 8を横に結合）
+                subprocess.run(
+                    [
+                        "convert",
+                        numbered_files[6],
+                        numbered_files[7],
+                        numbered_files[8],
+                        "+append",
+                        str(row3_file),
+                    ],
+                    check=True,
+                )
 
-            # 3つの行を縦に結合
-            subprocess.run(
-                [
-                    "convert",
-                    str(row1_file),
-                    str(row2_file),
-                    str(row3_file),
-                    "-append",
-                    str(result_image),
-                ],
-                check=True,
-            )
+                # 3つの行を縦に結合
+                subprocess.run(
+                    [
+                        "convert",
+                        str(row1_file),
+                        str(row2_file),
+                        str(row3_file),
+                        "-append",
+                        str(result_image),
+                    ],
+                    check=True,
+                )
 
         return str(result_image)
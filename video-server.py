@@ -1,16 +1,210 @@
+import asyncio
+import json
 import logging
+import os
+import random
+import subprocess
+import time
+from collections import deque
+from contextlib import asynccontextmanager
 from enum import Enum
+from urllib.parse import urlencode, urljoin
 
 import httpx
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import RedirectResponse
+from fastapi import Body, Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
+from pydantic import BaseModel, Field
 
 import util
+from util import metrics, ratelimit, timing
 
 logger = logging.getLogger("uvicorn")
 istream = util.ImageStream()
-app = FastAPI(title="video")
+proxies = (
+    util.ProxyResolver.load(os.environ["PROXY_BACKENDS"])
+    if os.getenv("PROXY_BACKENDS")
+    else util.ProxyResolver()
+)
+cluster = util.Cluster(
+    [node for node in os.getenv("CLUSTER_NODES", "").split(",") if node],
+    os.getenv("CLUSTER_SELF"),
+    os.getenv("CLUSTER_TOKEN"),
+)
+limiter = (
+    util.RateLimiter.load(os.environ["RATE_LIMITS"])
+    if os.getenv("RATE_LIMITS")
+    else util.RateLimiter()
+)
+# 担当から外れたストリームは次の削除対象にする
+cluster.on_change = lambda: istream.deprioritize(lambda key: not cluster.owns(key))
+
+
+async def build(spec: dict) -> str | None:
+    """spec のストリーム等を構築してリダイレクト先を返す"""
+    response = await root(spec["url"], spec["interval"], spec["loop"], wait=True, hop=0)
+    location = response.headers.get("location")
+    # 担当が他ノードならそのノードで構築させる
+    # (リクエスト外のジョブなので、担当ノードでもレート制限しないよう内部リクエストとする)
+    if location is not None and cluster.is_peer(location):
+        headers = {"X-Cluster-Token": cluster.token} if cluster.token else {}
+        async with httpx.AsyncClient() as client:
+            response = await client.get(location, headers=headers, timeout=120.0)
+            if "location" not in response.headers:
+                response.raise_for_status()
+                raise ValueError(f"No redirect from {location}")
+            location = urljoin(location, response.headers["location"])
+    return location
+
+
+jobs = util.Jobs(build)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await asyncio.to_thread(istream.prepare_loading)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.error(f"Failed to prepare loading stream: {e}")
+    await jobs.start()
+    proxies.start()
+    cluster.start()
+    # 起動時のプリウォーム (PREWARM_FILE)
+    prewarm_file = os.getenv("PREWARM_FILE")
+    if prewarm_file:
+        try:
+            with open(prewarm_file, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            if len(entries) > istream.MAX_NUM_PROCESSES:
+                logger.warning(
+                    f"Prewarm file has {len(entries)} entries, "
+                    f"only the first {istream.MAX_NUM_PROCESSES} are used"
+                )
+                entries = entries[: istream.MAX_NUM_PROCESSES]
+            for entry in entries:
+                spec = prewarm_spec(entry)
+                jobs.submit(spec, await job_key(spec), kind="prewarm")
+            logger.info(f"Prewarm {len(entries)} entries from {prewarm_file}")
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load prewarm file {prewarm_file}: {e}")
+    yield
+    await cluster.stop()
+    await proxies.stop()
+    await jobs.stop()
+
+
+app = FastAPI(title="video", lifespan=lifespan)
+
+
+def is_admin(authorization: str | None) -> bool:
+    token = os.getenv("ADMIN_TOKEN")
+    return bool(token) and authorization == f"Bearer {token}"
+
+
+def require_admin(authorization: str | None = Header(None)):
+    """管理用APIの認証 (Authorization: Bearer $ADMIN_TOKEN)"""
+    if not os.getenv("ADMIN_TOKEN"):
+        raise HTTPException(status_code=403, detail="Admin API is disabled")
+    if not is_admin(authorization):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+PROFILE_TOP = 20  # ログに出すスタックの数
+profile_rate = 0.0  # プロファイルするリクエストの割合 (管理用APIで変更)
+profiles = deque(maxlen=20)  # 直近のプロファイル結果
+# 視聴者のプレイヤーが頻繁に取得する HLS のファイルはミドルウェアで扱わない
+STREAM_PATH = "/video/stream/"
+
+
+@app.middleware("http")
+async def client_address(request: Request, call_next):
+    """レート制限のためにクライアントの IP を記録する
+
+    他ノードのジョブからの転送はリクエスト外の扱い (None) にして制限しない
+    """
+    if request.url.path.startswith(STREAM_PATH):
+        return await call_next(request)
+    host = request.client.host if request.client else None
+    if cluster.is_internal(host, request.headers.get("x-cluster-token")):
+        host = None
+    token = ratelimit.client.set(host)
+    try:
+        return await call_next(request)
+    finally:
+        ratelimit.client.reset(token)
+
+
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    """処理段階ごとの時間を Server-Timing ヘッダとログに出す
+
+    profile_rate の割合のリクエスト、または管理者が X-Profile: 1 を付けた
+    リクエストはサンプリングプロファイラで計測する
+    """
+    if request.url.path.startswith(STREAM_PATH):
+        return await call_next(request)
+    profile = random.random() < profile_rate or (
+        request.headers.get("x-profile") == "1"
+        and is_admin(request.headers.get("authorization"))
+    )
+    profiler = None
+    if profile:
+        profiler = util.Profiler()
+        profiler.start()
+
+    token = timing.begin()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        total = time.perf_counter() - start
+        spans = timing.end(token)
+        stacks = profiler.stop() if profiler is not None else None
+
+    response.headers["Server-Timing"] = timing.server_timing(spans, total)
+    fields = {
+        "method": request.method,
+        "path": request.url.path,
+        "status": response.status_code,
+        "total_ms": round(total * 1000, 1),
+    }
+    for name, seconds in spans:
+        key = f"{name}_ms"
+        fields[key] = round(fields.get(key, 0.0) + seconds * 1000, 1)
+    logger.info(f"Timing {timing.logfmt(fields)}")
+
+    if stacks is not None:
+        profiles.append(
+            {
+                "time": time.time(),
+                "path": request.url.path,
+                "query": request.url.query,
+                "total": total,
+                "samples": profiler.samples,
+                "stacks": stacks[:PROFILE_TOP],
+            }
+        )
+        logger.info(
+            f"Profiled {request.url.path} ({profiler.samples} samples), top stacks:"
+        )
+        for stack, count in stacks[:PROFILE_TOP]:
+            logger.info(f"  {count} {stack}")
+    return response
+
+
+@app.post("/video/admin/profile", dependencies=[Depends(require_admin)])
+async def set_profile_rate(rate: float = Body(..., embed=True, ge=0.0, le=1.0)):
+    """プロファイルするリクエストの割合を設定する (0 で無効)"""
+    global profile_rate
+    profile_rate = rate
+    logger.info(f"Profile rate set to {rate}")
+    return {"rate": profile_rate}
+
+
+@app.get("/video/admin/profile", dependencies=[Depends(require_admin)])
+async def get_profiles():
+    """直近のプロファイル結果"""
+    return {"rate": profile_rate, "profiles": list(profiles)}
 
 
 class UrlType(Enum):
@@ -59,6 +253,8 @@ async def root(
     url: list[str] = Query(...),
     interval: int = Query(8, ge=1, le=30),
     loop: int = Query(100, ge=1),
+    wait: bool = Query(True),
+    hop: int = Query(0, ge=0),
 ):
     """Redirect API
 
@@ -71,57 +267,97 @@ async def root(
         スライドショーの画像切り替え間隔（秒）
     loop
         スライドショーのループ回数（デフォルト: 100）
+    wait
+        false の場合、未構築のストリームはバックグラウンドで構築し
+        即座に「読み込み中」ストリームへリダイレクトする
+        ジョブIDは X-Job-Id ヘッダで返す
+    hop
+        クラスタ内で転送された回数 (1以上なら担当でなくても自ノードで処理する)
     """
+    start = time.perf_counter()
+    urls = url
+
     # スライドショーモード判定
     if len(url) >= 2:
+        stream_key = istream.slideshow_key(url, interval, loop)
+        ops = expensive_ops(None, url, stream_key)
+        response = await place(stream_key, ops, urls, interval, loop, wait, hop)
+        if response is not None:
+            return response
+        limiter.check(*ops)
+
         logger.info(
             f"Slideshow mode: {len(url)} images, duration={interval}s, loop={loop}"
         )
-        return await istream.get_slideshow(urls=url, duration=interval, loop_count=loop)
+        with metrics.REDIRECT_SECONDS.time(type="slideshow"):
+            return await istream.get_slideshow(
+                urls=url, duration=interval, loop_count=loop
+            )
 
     # 単一URL（既存の動作）
     url: str = url[0]
-    url_type = await UrlType.from_url(url)
+    with metrics.URL_TYPE_SECONDS.time(), timing.span("classify"):
+        url_type = await UrlType.from_url(url)
     logger.info(f"Accepted {url_type}({url})")
 
-    match url_type:
-        case UrlType.Video:
-            converted_url = convert(url)
-            logger.info(f"Video URL converted: {url} -> {converted_url}")
-            return RedirectResponse(converted_url)
-
-        case UrlType.Random:
-            video_url = await util.Random().get()
-            converted_url = convert(video_url)
-            logger.info(f"A random video chosen: {converted_url}")
-            return RedirectResponse(converted_url)
-
-        case UrlType.Image:
-            logger.info(f"Streaming an image: {url}")
-            return await istream.get(url=url)
-
-        case UrlType.YouTubeSearch:
-            url_part = url[2:]  # y! の後の部分を取得
-
-            # y!{keyword}!{index} の場合は特定の動画を取得
-            if "!" in url_part:
-                parts = url_part.split("!")
-                keyword = parts[0]
-                try:
-                    index = int(parts[1])
-                    youtube = util.YouTube()
-                    video_info = await youtube.get_from_search(keyword, index)
-                    logger.info(f"Redirecting to YouTube video: {video_info['url']}")
-                    return RedirectResponse(video_info["url"])
-                except (ValueError, IndexError):
-                    # インデックスが無効な場合は検索結果画像を表示
-                    pass
-
-            # y!{keyword} の場合は検索結果画像を表示
-            keyword = url_part.split("!")[0]  # !があっても最初の部分をキーワードとする
-            logger.info(f"YouTube search for keyword: {keyword}")
-            image_path = await util.YouTube().search_result(keyword)
-            return await istream.get(path=image_path)
+    stream_key = stream_key_of(url_type, url)
+    ops = expensive_ops(url_type, url, stream_key)
+    response = await place(stream_key, ops, urls, interval, loop, wait, hop)
+    if response is not None:
+        return response
+    limiter.check(*ops)
+
+    try:
+        match url_type:
+            case UrlType.Video:
+                converted_url = convert(url)
+                logger.info(f"Video URL converted: {url} -> {converted_url}")
+                return RedirectResponse(converted_url)
+
+            case UrlType.Random:
+                with timing.span("random"):
+                    video_url = await util.Random().get()
+                converted_url = convert(video_url)
+                logger.info(f"A random video chosen: {converted_url}")
+                return RedirectResponse(converted_url)
+
+            case UrlType.Image:
+                logger.info(f"Streaming an image: {url}")
+                return await istream.get(url=url)
+
+            case UrlType.YouTubeSearch:
+                keyword, index = parse_youtube_search(url)
+
+                # y!{keyword}!{index} の場合は特定の動画を取得
+                if index is not None:
+                    try:
+                        youtube = util.YouTube()
+                        video_info = await youtube.get_from_search(keyword, index)
+                        logger.info(
+                            f"Redirecting to YouTube video: {video_info['url']}"
+                        )
+                        return RedirectResponse(video_info["url"])
+                    except IndexError:
+                        # インデックスが無効な場合は検索結果画像を表示
+                        # (y!{keyword} として担当ノード・ジョブ・レート制限を決め直す)
+                        grid_url = f"y!{keyword}"
+                        grid_key = stream_key_of(url_type, grid_url)
+                        ops = expensive_ops(url_type, grid_url, grid_key)
+                        response = await place(
+                            grid_key, ops, [grid_url], interval, loop, wait, hop
+                        )
+                        if response is not None:
+                            return response
+                        limiter.check(*ops)
+
+                # y!{keyword} の場合は検索結果画像を表示
+                logger.info(f"YouTube search for keyword: {keyword}")
+                image_path = await util.YouTube().search_result(keyword)
+                return await istream.get(path=image_path)
+    finally:
+        metrics.REDIRECT_SECONDS.observe(
+            time.perf_counter() - start, type=url_type.value
+        )
 
 
 @app.get("/video")
@@ -129,13 +365,316 @@ async def video(
     url: list[str] = Query(...),
     interval: int = Query(8, ge=1, le=30),
     loop: int = Query(100, ge=1),
+    wait: bool = Query(True),
+    hop: int = Query(0, ge=0),
+):
+    return await root(url, interval, loop, wait, hop)
+
+
+def stream_key_of(url_type: UrlType, url: str) -> str | None:
+    """単一 URL のストリームキー (ストリームを伴わない URL は None)
+
+    y!{keyword}!{index} は動画へのリダイレクトなので None
+    (インデックスが無効なら root で y!{keyword} として扱い直す)
+    """
+    match url_type:
+        case UrlType.Image:
+            return istream.key(url=url)
+        case UrlType.YouTubeSearch:
+            keyword, index = parse_youtube_search(url)
+            if index is None:
+                image_path = str(util.YouTube.search_result_path(keyword))
+                return istream.key(path=image_path)
+    return None
+
+
+def expensive_ops(url_type: UrlType | None, url: str, stream_key: str | None):
+    """キャッシュに無く、レート制限の対象になる操作
+
+    Parameters
+    ----------
+    url_type
+        単一 URL の種別 (スライドショーは None)
+    """
+    ops = []
+    if stream_key is not None and not istream.ready(stream_key):
+        ops.append("stream")
+    if url_type == UrlType.YouTubeSearch:
+        keyword, index = parse_youtube_search(url)
+        grid = index is None and not util.YouTube.is_cached(
+            util.YouTube.search_result_path(keyword)
+        )
+        if grid:
+            ops.append("grid")
+        if (grid or index is not None) and not util.YouTube.is_cached(
+            util.YouTube.search_path(keyword)
+        ):
+            ops.append("search")
+    return ops
+
+
+async def place(
+    stream_key: str | None,
+    ops: list[str],
+    url: list[str],
+    interval: int,
+    loop: int,
+    wait: bool,
+    hop: int,
+) -> RedirectResponse | None:
+    """ストリームを伴う URL をどこで構築するか決める
+
+    - クラスタで他ノードの担当なら、そのノードへリダイレクト
+    - 同じストリームを構築中のジョブがあれば、
+      wait=false なら読み込み中ストリームへリダイレクトし、そうでなければ終わるまで待つ
+    - wait=false で未構築なら、ジョブに登録して読み込み中ストリームへリダイレクト
+      (ジョブはリクエスト外で動くので、ここで ops のレート制限を確認する)
+      読み込み中ストリームが無い (起動時の作成に失敗した) 場合は wait=true と同じ
+
+    ジョブは stream_key ごとに一つで、X-Job-Id も stream_key になる
+    自ノードでそのまま処理する場合は None
+    """
+    if stream_key is None:
+        return None
+
+    owner = cluster.owner(stream_key)
+    if hop == 0 and not cluster.owns(stream_key):
+        params = [("url", u) for u in url]
+        params += [("interval", interval), ("loop", loop)]
+        params += [("wait", str(wait).lower()), ("hop", hop + 1)]
+        logger.info(f"Stream {stream_key} is owned by {owner}")
+        return RedirectResponse(
+            url=f"{owner}/video?{urlencode(params)}", status_code=302
+        )
+
+    if istream.ready(stream_key):
+        return None
+
+    loading = not wait and istream.ready(istream.LOADING_KEY)
+    if jobs.building(stream_key):
+        if not loading:
+            logger.info(f"Stream {stream_key} is being built, waiting for the job")
+            await jobs.wait(stream_key)
+            if istream.ready(stream_key):
+                return RedirectResponse(
+                    url=f"/video/stream/{stream_key}/index.m3u8", status_code=302
+                )
+            # ジョブが失敗したので自分で構築する
+            return None
+        job_id = stream_key
+    elif not loading:
+        if not wait:
+            logger.warning("Loading stream is not ready, building synchronously")
+        return None
+    else:
+        limiter.check(*ops)
+        spec = {"url": url, "interval": interval, "loop": loop}
+        job_id = jobs.submit(spec, stream_key)
+    logger.info(f"Stream {stream_key} is cold, building in job {job_id}")
+    return RedirectResponse(
+        url=f"/video/stream/{istream.LOADING_KEY}/index.m3u8",
+        status_code=302,
+        headers={"X-Job-Id": job_id},
+    )
+
+
+@app.get("/video/cluster")
+async def cluster_status():
+    """クラスタのメンバーと死活 (他ノードからの死活確認にも使う)"""
+    return cluster.status()
+
+
+@app.get("/video/jobs/{job_id}")
+async def job_status(job_id: str):
+    """ジョブの状態 (queued, running, done, failed, stale)
+
+    done になれば result がリダイレクト先
+    """
+    job = jobs.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_view(job)
+
+
+def job_view(job: dict) -> dict:
+    """ジョブの状態を返す
+
+    構築したストリームがその後削除されていれば status は stale
+    """
+    location = job["result"] or ""
+    if job["status"] == "done" and location.startswith("/video/stream/"):
+        stream_key = location.split("/")[3]
+        if not istream.ready(stream_key):
+            return {**job, "status": "stale"}
+    return job
+
+
+def parse_youtube_search(url: str) -> tuple[str, int | None]:
+    """y!{keyword} または y!{keyword}!{index} を分解する
+
+    Examples
+    --------
+    >>> parse_youtube_search("y!cats")
+    ('cats', None)
+
+    >>> parse_youtube_search("y!cats!2")
+    ('cats', 2)
+
+    インデックスが不正な場合は None
+    >>> parse_youtube_search("y!cats!x")
+    ('cats', None)
+    """
+    parts = url[2:].split("!")  # y! の後の部分を取得
+    keyword = parts[0]  # !があっても最初の部分をキーワードとする
+    index = None
+    if len(parts) >= 2:
+        try:
+            index = int(parts[1])
+        except ValueError:
+            pass
+    return keyword, index
+
+
+RESOLVE_CONCURRENCY = 8
+RESOLVE_MAX_URLS = 200
+
+
+async def resolve(url: str) -> dict:
+    """URL を分類・変換してリダイレクト先を返す
+
+    画像ストリームは構築せず、ストリームキーと構築済みかどうかを返す
+    """
+    result = {"url": url}
+    try:
+        url_type = await UrlType.from_url(url)
+        result["type"] = url_type.value
+        match url_type:
+            case UrlType.Video:
+                result["location"] = convert(url)
+
+            case UrlType.Random:
+                result["location"] = convert(await util.Random().get())
+
+            case UrlType.Image:
+                result["stream_key"] = istream.key(url=url)
+
+            case UrlType.YouTubeSearch:
+                keyword, index = parse_youtube_search(url)
+                if index is not None:
+                    limiter.check(*expensive_ops(url_type, url, None))
+                    try:
+                        video_info = await util.YouTube().get_from_search(
+                            keyword, index
+                        )
+                        result["location"] = video_info["url"]
+                    except IndexError:
+                        pass
+                if "location" not in result:
+                    image_path = str(util.YouTube.search_result_path(keyword))
+                    result["stream_key"] = istream.key(path=image_path)
+    except HTTPException as e:
+        result["error"] = e.detail
+    except (httpx.HTTPError, ValueError) as e:
+        result["error"] = str(e)
+
+    if "stream_key" in result:
+        stream_key = result["stream_key"]
+        result["location"] = f"/video/stream/{stream_key}/index.m3u8"
+        if cluster.owns(stream_key):
+            result["ready"] = istream.ready(stream_key)
+        else:
+            # 他ノードの担当 (そのノードの /video?url= で構築される)
+            result["node"] = cluster.owner(stream_key)
+            result["location"] = result["node"] + result["location"]
+    return result
+
+
+@app.post("/video/resolve")
+async def resolve_many(
+    urls: list[str] = Body(..., embed=True, max_length=RESOLVE_MAX_URLS),
 ):
-    return await root(url, interval, loop)
+    """複数の URL をまとめて分類・変換する
+
+    動画はリダイレクト先 (location)、画像はストリームキー (stream_key) を返す
+    画像ストリームは構築しないので、ready でなければ /video?url= で構築する
+    """
+    semaphore = asyncio.Semaphore(RESOLVE_CONCURRENCY)
+
+    async def _resolve(url: str) -> dict:
+        async with semaphore:
+            return await resolve(url)
+
+    return await asyncio.gather(*(_resolve(url) for url in urls))
+
+
+class PrewarmSpec(BaseModel):
+    url: list[str] = Field(..., min_length=1)
+    interval: int = Field(8, ge=1, le=30)
+    loop: int = Field(100, ge=1)
+
+
+def prewarm_spec(entry: str | list[str] | dict | PrewarmSpec) -> dict:
+    """プリウォームの指定をジョブの spec に正規化する
+
+    Parameters
+    ----------
+    entry
+        URL または y!{keyword} (str)
+        スライドショーの URL リスト (list[str])
+        {"url": [...], "interval": int, "loop": int}
+    """
+    if isinstance(entry, str):
+        entry = PrewarmSpec(url=[entry])
+    elif isinstance(entry, list):
+        entry = PrewarmSpec(url=entry)
+    elif isinstance(entry, dict):
+        entry = PrewarmSpec(**entry)
+    return entry.model_dump()
+
+
+async def job_key(spec: dict) -> str | None:
+    """spec が構築するストリームのキー (ストリームを伴わなければ None)
+
+    同じストリームを構築するジョブを一つにまとめるために使う
+    """
+    urls = spec["url"]
+    if len(urls) >= 2:
+        return istream.slideshow_key(urls, spec["interval"], spec["loop"])
+    try:
+        url_type = await UrlType.from_url(urls[0])
+    except HTTPException:
+        return None
+    return stream_key_of(url_type, urls[0])
+
+
+@app.post("/video/prewarm", dependencies=[Depends(require_admin)])
+async def prewarm(entries: list[str | list[str] | PrewarmSpec] = Body(...)):
+    """ストリームや検索結果をバックグラウンドで事前に構築する
+
+    構築は通常のリクエストと同じ経路 (MAX_NUM_PROCESSES の制限下) で行われる
+    それを超える数を指定すると先に構築したものが削除されるので受け付けない
+    """
+    if len(entries) > istream.MAX_NUM_PROCESSES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many entries (max {istream.MAX_NUM_PROCESSES})",
+        )
+    specs = [prewarm_spec(entry) for entry in entries]
+    job_ids = [jobs.submit(spec, await job_key(spec), kind="prewarm") for spec in specs]
+    return [job_view(jobs.status(job_id)) for job_id in job_ids]
+
+
+@app.get("/video/prewarm", dependencies=[Depends(require_admin)])
+async def prewarm_status():
+    """プリウォームジョブの状態一覧 (wait=false 等の他のジョブは含まない)"""
+    return [job_view(job) for job in jobs.jobs.values() if job["kind"] == "prewarm"]
 
 
 def convert(url: str) -> str:
     """一部動画URLを専用URLに変換する
 
+    変換先の候補は util.ProxyResolver の表 (PROXY_BACKENDS で差し替え可能)
+
     Parameters
     ----------
     url
@@ -163,25 +702,26 @@ def convert(url: str) -> str:
     'https://www.youtube.com/watch?v=abcd'
     """
 
-    # ニコニコ動画
-    if "nicovideo.jp/watch/" in url:
-        video_id = url.split("/")[-1].split("?")[0]
-        return f"https://www.nicovideo.life/watch?v={video_id}"
+    # プラットフォームごとに最速の healthy なプロキシを選ぶ
+    # (プローブ前は表の先頭)
+    return proxies.resolve(url)
 
-    # ビリビリ動画
-    if "bilibili.com/video/" in url:
-        return f"https://biliplayer.91vrchat.com/player/?url={url}"
 
-    # iwara
-    if "iwara.tv/video/" in url:
-        return f"https://nicovrc.net/proxy/?{url}"
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus 形式のメトリクス"""
+    # /proc とディスクの読み込みだけスレッドで行い、書き出しはイベントループで
+    collected = await asyncio.to_thread(
+        metrics.collect, istream.processes, [istream.BASE_DIR, util.YouTube.CACHE_DIR]
+    )
+    body = metrics.render(collected)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
 
-    # X (Twitter)
-    if "x.com/" in url:
-        return f"https://nicovrc.net/proxy/?{url}"
 
-    # それ以外はそのまま返す
-    return url
+@app.get("/video/proxies", dependencies=[Depends(require_admin)])
+async def proxy_status():
+    """プロキシ候補のレイテンシと健全性"""
+    return proxies.status()
 
 
 # ImageStream